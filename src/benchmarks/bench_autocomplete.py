@@ -0,0 +1,282 @@
+"""
+Load test the /autocomplete endpoint with replayed typing sessions.
+
+Each session replays one email word by word the way content.js does: a
+request with the subject and the text typed so far is sent every time a
+space is typed. Sessions come from threads.json or a synthetic corpus and
+are replayed by a configurable number of concurrent clients.
+
+Reports p50/p95/p99 latency and throughput, plus CPU time and RSS of the
+server process(es) when --server-pid is given, and writes the results as
+JSON so runs with different decoding or backend settings can be compared.
+
+Usage:
+    python src/benchmarks/bench_autocomplete.py --threads-file src/gcloud/threads.json \\
+        --concurrency 4 --server-pid 12345 --label beam5 --output beam5.json
+"""
+
+import argparse
+import json
+import os
+import queue
+import random
+import statistics
+import threading
+import time
+
+import requests
+
+SYNTHETIC_SUBJECTS = [
+    "Quick question",
+    "Meeting next week",
+    "Follow up on our call",
+    "Project update",
+    "Thanks!",
+]
+SYNTHETIC_SENTENCES = [
+    "Hope you are doing well.",
+    "I wanted to follow up on our conversation from last week.",
+    "Let me know if you have any questions.",
+    "Would you be free to meet on Tuesday or Wednesday afternoon?",
+    "Thanks again for all of your help with this.",
+    "I just sent over the updated draft for you to review.",
+    "Looking forward to hearing from you.",
+    "Please let me know what works best for your schedule.",
+]
+
+
+def load_sessions(threads_file, max_sessions, seed=0):
+    """Load (subject, body) typing sessions from threads.json."""
+    with open(threads_file, "r", encoding="utf-8") as file:
+        threads = json.load(file)
+    sessions = [
+        (thread.get("subject", ""), thread.get("body", ""))
+        for thread in threads
+        if thread.get("body", "").strip()
+    ]
+    random.Random(seed).shuffle(sessions)
+    return sessions[:max_sessions]
+
+
+def synthetic_sessions(max_sessions, seed=0):
+    """Build (subject, body) typing sessions from stock phrases."""
+    rng = random.Random(seed)
+    return [
+        (
+            rng.choice(SYNTHETIC_SUBJECTS),
+            " ".join(rng.choices(SYNTHETIC_SENTENCES, k=rng.randint(2, 8))),
+        )
+        for _ in range(max_sessions)
+    ]
+
+
+def session_requests(subject, body, max_words):
+    """Requests content.js would send while typing `body`, one per space."""
+    words = body.split()[:max_words]
+    text_so_far = ""
+    for word in words:
+        text_so_far += word + " "
+        yield {"subject": subject, "text_so_far": text_so_far}
+
+
+def process_tree(pid):
+    """The pid and all of its descendants (Linux only)."""
+    pids = [pid]
+    try:
+        for task in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{task}/children", "r") as file:
+                for child in file.read().split():
+                    pids.extend(process_tree(int(child)))
+    except OSError:
+        pass
+    return pids
+
+
+def read_cpu_seconds(pid):
+    """User + system CPU time of a process from /proc/<pid>/stat."""
+    with open(f"/proc/{pid}/stat", "r") as file:
+        # Skip past the command name, which may contain spaces
+        fields = file.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def read_rss_bytes(pid):
+    """Resident set size of a process from /proc/<pid>/statm."""
+    with open(f"/proc/{pid}/statm", "r") as file:
+        return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+class ResourceMonitor:
+    """Sample CPU time and RSS of the server processes during a run."""
+
+    def __init__(self, pid, interval=0.5):
+        self.pid = pid
+        self.interval = interval
+        self.rss_samples = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def _cpu_seconds(self):
+        return sum(read_cpu_seconds(pid) for pid in process_tree(self.pid))
+
+    def _sample(self):
+        while not self._stop.is_set():
+            try:
+                self.rss_samples.append(
+                    sum(read_rss_bytes(pid) for pid in process_tree(self.pid))
+                )
+            except OSError:
+                pass
+            self._stop.wait(self.interval)
+
+    def start(self):
+        self._start_cpu = self._cpu_seconds()
+        self._start_time = time.perf_counter()
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        elapsed = time.perf_counter() - self._start_time
+        cpu_seconds = self._cpu_seconds() - self._start_cpu
+        return {
+            "cpu_seconds": cpu_seconds,
+            "cpu_utilization": cpu_seconds / elapsed if elapsed else 0.0,
+            "peak_rss_mb": max(self.rss_samples, default=0) / 2**20,
+            "mean_rss_mb": statistics.mean(self.rss_samples or [0]) / 2**20,
+        }
+
+
+def run_client(url, sessions, max_words, think_time, results, lock):
+    """Replay sessions from the queue until it is empty."""
+    http = requests.Session()  # Keep-alive, like the browser
+    while True:
+        try:
+            subject, body = sessions.get_nowait()
+        except queue.Empty:
+            return
+        for payload in session_requests(subject, body, max_words):
+            start = time.perf_counter()
+            try:
+                response = http.post(url, json=payload, timeout=60)
+                ok = response.ok
+            except requests.RequestException:
+                ok = False
+            latency = time.perf_counter() - start
+            with lock:
+                results.append((latency, ok))
+            if think_time:
+                time.sleep(think_time)
+
+
+def percentile(values, pct):
+    """Linear-interpolated percentile of a sorted list."""
+    if not values:
+        return 0.0
+    k = (len(values) - 1) * pct / 100
+    low = int(k)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (k - low)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--url", default="http://127.0.0.1:5000/autocomplete")
+    parser.add_argument("--threads-file", help="threads.json (default: synthetic)")
+    parser.add_argument("--sessions", type=int, default=50)
+    parser.add_argument("--max-words", type=int, default=60)
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument(
+        "--think-ms", type=float, default=0, help="Pause between words per client"
+    )
+    parser.add_argument("--server-pid", type=int, help="Server pid to monitor")
+    parser.add_argument("--label", default="", help="Name for this run")
+    parser.add_argument(
+        "--tag",
+        action="append",
+        default=[],
+        help="key=value describing the run, e.g. num_beams=5 (repeatable)",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    if args.threads_file:
+        sessions = load_sessions(args.threads_file, args.sessions, args.seed)
+    else:
+        sessions = synthetic_sessions(args.sessions, args.seed)
+    session_queue = queue.Queue()
+    for session in sessions:
+        session_queue.put(session)
+
+    monitor = ResourceMonitor(args.server_pid) if args.server_pid else None
+    results = []
+    lock = threading.Lock()
+    clients = [
+        threading.Thread(
+            target=run_client,
+            args=(
+                args.url,
+                session_queue,
+                args.max_words,
+                args.think_ms / 1000,
+                results,
+                lock,
+            ),
+        )
+        for _ in range(args.concurrency)
+    ]
+
+    print(f"Replaying {len(sessions)} sessions with {args.concurrency} clients...")
+    if monitor:
+        monitor.start()
+    start = time.perf_counter()
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(latency for latency, ok in results if ok)
+    summary = {
+        "requests": len(results),
+        "errors": sum(1 for _, ok in results if not ok),
+        "elapsed_seconds": elapsed,
+        "throughput_rps": len(latencies) / elapsed if elapsed else 0.0,
+        "latency_ms": {
+            "mean": statistics.mean(latencies or [0]) * 1000,
+            "p50": percentile(latencies, 50) * 1000,
+            "p95": percentile(latencies, 95) * 1000,
+            "p99": percentile(latencies, 99) * 1000,
+            "max": (latencies[-1] if latencies else 0) * 1000,
+        },
+    }
+    if monitor:
+        summary["server"] = monitor.stop()
+
+    print(f"Requests: {summary['requests']} ({summary['errors']} errors)")
+    print(f"Throughput: {summary['throughput_rps']:.2f} req/s")
+    for key, value in summary["latency_ms"].items():
+        print(f"Latency {key}: {value:.1f} ms")
+    if monitor:
+        for key, value in summary["server"].items():
+            print(f"Server {key}: {value:.2f}")
+
+    if args.output:
+        config = {
+            "label": args.label,
+            "tags": dict(tag.split("=", 1) for tag in args.tag),
+            "url": args.url,
+            "corpus": args.threads_file or "synthetic",
+            "sessions": len(sessions),
+            "max_words": args.max_words,
+            "concurrency": args.concurrency,
+            "think_ms": args.think_ms,
+        }
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump({"config": config, "results": summary}, file, indent=4)
+        print(f"Results saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+Check and benchmark speculative decoding against plain greedy search.
+
+Builds the n-gram draft from part of threads.json, then for typing prefixes
+taken from the remaining emails runs both `model.generate` greedy search and
+`speculative_generate`. Every output is checked to be identical, and the
+speedup and draft acceptance rate are reported. Exits with status 1 if any
+output differs.
+
+Usage:
+    python src/benchmarks/bench_speculative.py --threads-file src/gcloud/threads.json
+"""
+
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.abspath(os.path.join(SCRIPT_DIR, "../../"))
+MODEL_PATH = os.path.join(
+    PROJECT_ROOT, "src/transformers/fine_tuned_model_email_writer"
+)
+
+sys.path.append(os.path.join(PROJECT_ROOT, "src/common"))
+from context_window import build_input_text
+from model_loader import ModelLoader
+from speculative_decoding import TokenNgramDraft, speculative_generate
+
+
+def typing_prefixes(threads, num_prompts, seed=0):
+    """Subject and a random word prefix of the body, one per email."""
+    rng = random.Random(seed)
+    prompts = []
+    for thread in threads:
+        words = thread.get("body", "").split()
+        if len(words) < 2:
+            continue
+        cut = rng.randint(1, len(words) - 1)
+        prompts.append(
+            build_input_text(thread.get("subject", ""), " ".join(words[:cut]))
+        )
+    return prompts[:num_prompts]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--threads-file", required=True)
+    parser.add_argument("--model-path", default=MODEL_PATH)
+    parser.add_argument("--num-prompts", type=int, default=100)
+    parser.add_argument("--max-length", type=int, default=50)
+    parser.add_argument("--num-draft-tokens", type=int, default=4)
+    parser.add_argument("--draft-order", type=int, default=3)
+    parser.add_argument(
+        "--holdout", type=float, default=0.2, help="Share of emails used as prompts"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    import torch
+
+    tokenizer, model = ModelLoader(args.model_path).load()
+
+    with open(args.threads_file, "r", encoding="utf-8") as file:
+        threads = json.load(file)
+    random.Random(args.seed).shuffle(threads)
+    split = int(len(threads) * (1 - args.holdout))
+    draft = TokenNgramDraft.from_texts(
+        tokenizer,
+        (thread.get("body", "") for thread in threads[:split]),
+        args.draft_order,
+    )
+    prompts = typing_prefixes(threads[split:], args.num_prompts, args.seed)
+    print(f"Draft built from {split} emails, evaluating {len(prompts)} prompts...")
+
+    greedy_times, speculative_times, mismatches = [], [], 0
+    totals = {"forward_passes": 0, "drafted_tokens": 0, "accepted_tokens": 0}
+    for prompt in prompts:
+        input_ids = tokenizer(prompt, return_tensors="pt").input_ids
+
+        start = time.perf_counter()
+        with torch.no_grad():
+            expected = model.generate(
+                input_ids, max_length=args.max_length, num_beams=1, do_sample=False
+            )
+        greedy_times.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        output_ids, stats = speculative_generate(
+            model, input_ids, draft, args.max_length, args.num_draft_tokens
+        )
+        speculative_times.append(time.perf_counter() - start)
+
+        for key in totals:
+            totals[key] += stats[key]
+        if output_ids[0].tolist() != expected[0].tolist():
+            mismatches += 1
+            print(f"Output differs for prompt: {prompt!r}")
+            print(f"  greedy:      {tokenizer.decode(expected[0])!r}")
+            print(f"  speculative: {tokenizer.decode(output_ids[0])!r}")
+
+    results = {
+        "prompts": len(prompts),
+        "mismatches": mismatches,
+        "greedy_ms": statistics.mean(greedy_times) * 1000,
+        "speculative_ms": statistics.mean(speculative_times) * 1000,
+        "speedup": sum(greedy_times) / sum(speculative_times),
+        "acceptance_rate": totals["accepted_tokens"] / max(totals["drafted_tokens"], 1),
+        "forward_passes_per_prompt": totals["forward_passes"] / len(prompts),
+    }
+    for key, value in results.items():
+        print(f"{key}: {value:.3f}" if isinstance(value, float) else f"{key}: {value}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump({"config": vars(args), "results": results}, file, indent=4)
+        print(f"Results saved to {args.output}")
+
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+Measure model server startup time.
+
+Starts the model server in a subprocess and records how long it takes until
+/healthz first answers (process up) and until /readyz reports ready (model
+loaded and warmed up). Also times a bare ModelLoader load in a fresh
+interpreter, broken down into import, load and warmup.
+
+Usage:
+    python src/benchmarks/bench_startup.py --runs 3
+"""
+
+import argparse
+import json
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import time
+
+import requests
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.abspath(os.path.join(SCRIPT_DIR, "../../"))
+APP_PATH = os.path.join(PROJECT_ROOT, "src/chrome_extension/model_server/app.py")
+MODEL_PATH = os.path.join(
+    PROJECT_ROOT, "src/transformers/fine_tuned_model_email_writer"
+)
+
+LOADER_SNIPPET = """
+import json, sys, time
+start = time.perf_counter()
+sys.path.append({common!r})
+from model_loader import ModelLoader
+loader = ModelLoader({model_path!r}, warmup_runs={warmup_runs})
+loader.load()
+loader.timings["total_seconds"] = time.perf_counter() - start
+print(json.dumps(loader.timings))
+"""
+
+
+def time_loader(model_path, warmup_runs):
+    """Time a ModelLoader load in a fresh interpreter."""
+    snippet = LOADER_SNIPPET.format(
+        common=os.path.join(PROJECT_ROOT, "src/common"),
+        model_path=model_path,
+        warmup_runs=warmup_runs,
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", snippet], capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def time_server(port, warmup_runs, timeout=300):
+    """Start the model server and time /healthz and /readyz."""
+    env = dict(os.environ, WARMUP_RUNS=str(warmup_runs))
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, APP_PATH],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,  # So the debug reloader's child is killed too
+    )
+    timings = {}
+    try:
+        while time.perf_counter() - start < timeout:
+            for endpoint in ("healthz", "readyz"):
+                if endpoint in timings:
+                    continue
+                try:
+                    response = requests.get(
+                        f"http://127.0.0.1:{port}/{endpoint}", timeout=1
+                    )
+                except requests.RequestException:
+                    continue  # Not listening yet, or busy past the timeout
+                if response.ok:
+                    timings[endpoint] = time.perf_counter() - start
+            if "readyz" in timings:
+                return timings
+            time.sleep(0.05)
+        raise TimeoutError(f"Server not ready after {timeout}s")
+    finally:
+        os.killpg(process.pid, signal.SIGTERM)
+        process.wait()
+
+
+def summarize(runs):
+    """Median of each timing across runs."""
+    return {key: statistics.median(run[key] for run in runs) for key in runs[0]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--model-path", default=MODEL_PATH)
+    parser.add_argument("--warmup-runs", type=int, default=1)
+    parser.add_argument("--skip-server", action="store_true")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    results = {"warmup_runs": args.warmup_runs}
+
+    print(f"Timing ModelLoader ({args.runs} runs)...")
+    results["loader"] = summarize(
+        [time_loader(args.model_path, args.warmup_runs) for _ in range(args.runs)]
+    )
+    for key, value in results["loader"].items():
+        print(f"  {key}: {value:.3f}s")
+
+    if not args.skip_server:
+        print(f"Timing model server startup ({args.runs} runs)...")
+        results["server"] = summarize(
+            [time_server(args.port, args.warmup_runs) for _ in range(args.runs)]
+        )
+        for key, value in results["server"].items():
+            print(f"  time to {key}: {value:.3f}s")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=4)
+        print(f"Results saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
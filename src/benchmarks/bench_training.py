@@ -0,0 +1,87 @@
+"""
+Compare peak memory and throughput of the fine-tuning profiles.
+
+Runs fine_tune_transformer.py for a fixed number of optimizer steps with each
+training profile, each in a fresh process so peak memory is not shared, and
+prints peak RSS and training samples per second relative to the default
+profile. All profiles use an effective batch of 8 examples per step.
+
+Usage:
+    python src/benchmarks/bench_training.py --model facebook/bart-base --max-steps 20
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.abspath(os.path.join(SCRIPT_DIR, "../../"))
+TRAIN_PATH = os.path.join(PROJECT_ROOT, "src/transformers/fine_tune_transformer.py")
+DATA_PATH = os.path.join(PROJECT_ROOT, "src/gcloud/fine_tune_sentence_completion.json")
+
+
+def run_profile(profile, model, data, max_steps):
+    """Train briefly with one profile and return its report."""
+    with tempfile.TemporaryDirectory() as output_dir:
+        report_path = os.path.join(output_dir, "report.json")
+        subprocess.run(
+            [
+                sys.executable,
+                TRAIN_PATH,
+                "--profile",
+                profile,
+                "--model",
+                model,
+                "--data",
+                data,
+                "--max-steps",
+                str(max_steps),
+                "--output-dir",
+                output_dir,
+                "--report",
+                report_path,
+            ],
+            check=True,
+        )
+        with open(report_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--model", default="t5-small")
+    parser.add_argument("--data", default=DATA_PATH)
+    parser.add_argument("--max-steps", type=int, default=20)
+    parser.add_argument("--profiles", nargs="+", default=["default", "cpu_low_memory"])
+    args = parser.parse_args()
+
+    reports = [
+        run_profile(profile, args.model, args.data, args.max_steps)
+        for profile in args.profiles
+    ]
+
+    baseline = reports[0]
+    print(f"\n{args.model}, {args.max_steps} steps")
+    print(
+        f"{'profile':<16} {'peak MB':>9} {'vs base':>8} {'samples/s':>10} {'vs base':>8}"
+    )
+    for report in reports:
+        memory_ratio = report["peak_rss_mb"] / baseline["peak_rss_mb"]
+        speed_ratio = (
+            report["train_samples_per_second"] / baseline["train_samples_per_second"]
+        )
+        print(
+            f"{report['profile']:<16} {report['peak_rss_mb']:>9.0f} "
+            f"{memory_ratio:>7.2f}x {report['train_samples_per_second']:>10.2f} "
+            f"{speed_ratio:>7.2f}x"
+        )
+    for report in reports:
+        if "note" in report:
+            print(f"{report['profile']}: {report['note']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -17,80 +17,269 @@ function waitForGmail() {
     }, 500);
 }
 
+const SERVER_URL = "http://127.0.0.1:5000";
+const NUM_CANDIDATES = 5; // Ranked completions asked for, capped by the server's MAX_CANDIDATES
+
 function observeEmailInput(emailBody, emailSubject) {
     console.log("Observing Email Inputs...");
-    let userInput = ""; // Track the user's current input
     let suggestionActive = false; // Whether a suggestion is currently active
     let suggestionText = ""; // Store the current suggestion
+    let spaceTyped = false; // Request a suggestion with the next edit
+    let candidates = []; // Ranked completions of candidateBase from the server
+    let candidateBase = "";
+
+    function showCandidate(text) {
+        // Show the best candidate still consistent with what has been typed
+        const remainder = matchCandidate(candidates, candidateBase, text);
+        if (!remainder) {
+            return false;
+        }
+        suggestionText = remainder;
+        showSuggestion(emailBody, suggestionText);
+        suggestionActive = true;
+        return true;
+    }
 
-    emailBody.addEventListener("keydown", async (event) => {
-        const subject = emailSubject.value;
-    
-        // Update `userInput` based on key pressed
-        if (event.key === "Backspace") {
-            userInput = userInput.slice(0, -1);
-        } else if (event.key.length === 1) {
-            userInput += event.key; // Add visible characters (letters, spaces, etc.)
-        }
-    
-        console.log(`User Input: '${userInput}'`);
-    
+    const session = new SuggestionSession(emailSubject.value, (texts, text) => {
+        console.log("Candidates:", texts);
+        candidates = texts;
+        candidateBase = text;
+        showCandidate(text);
+    });
+
+    emailBody.addEventListener("keydown", (event) => {
         // Clear the active suggestion if the user starts typing
         if (suggestionActive && event.key.length === 1 && event.key !== "Tab") {
             clearSuggestion(emailBody);
             suggestionActive = false;
         }
-    
-        // Fetch and display a new suggestion if the user presses space
-        if (event.key === " " && userInput.endsWith(" ")) {
-            console.log("Space detected, fetching suggestion...");
-            suggestionText = await fetchSuggestion(subject, userInput);
-            console.log("Suggestion:", suggestionText);
-            if (suggestionText) {
-                showSuggestion(emailBody, suggestionText);
-                suggestionActive = true;
-            }
-        }
-    
+
+        // Fetch a new suggestion once the space reaches the DOM
+        spaceTyped = event.key === " ";
+
         // Handle Tab key to accept the suggestion
         if (event.key === "Tab" && suggestionActive) {
             event.preventDefault(); // Prevent default Tab behavior
             clearSuggestion(emailBody);
             acceptSuggestion(emailBody, suggestionText);
-            // clearSuggestion(emailBody);
-            userInput = emailBody.innerText || emailBody.textContent || "";
             suggestionActive = false;
+            // Programmatic edits do not fire input events
+            session.sync(getBodyText(emailBody), false);
         }
     });
-    
 
-    // Periodically synchronize `userInput` with the actual content
-    setInterval(() => {
-        const actualText = emailBody.innerText || emailBody.textContent || "";
-        if (!actualText.startsWith(userInput)) {
-            console.log("Resyncing userInput with actual content...");
-            userInput = actualText;
+    // Send only what changed on every edit, instead of the whole email. After
+    // a completed word, the server is only asked again once none of the
+    // candidates it sent last still match.
+    emailBody.addEventListener("input", () => {
+        const text = getBodyText(emailBody);
+        const matched = spaceTyped && showCandidate(text);
+        session.sync(text, spaceTyped && !matched);
+        spaceTyped = false;
+    });
+
+    emailSubject.addEventListener("input", () => {
+        session.setSubject(emailSubject.value);
+    });
+
+    window.addEventListener("beforeunload", () => session.close());
+}
+
+function getBodyText(emailBody) {
+    // Leave out the inline suggestion, and use plain spaces for Gmail's &nbsp;
+    let text = emailBody.innerText || emailBody.textContent || "";
+    const suggestionElement = emailBody.querySelector(".autocomplete-suggestion");
+    if (suggestionElement && text.endsWith(suggestionElement.innerText)) {
+        text = text.slice(0, text.length - suggestionElement.innerText.length);
+    }
+    return text.replace(/\u00a0/g, " ");
+}
+
+function matchCandidate(candidates, base, text) {
+    // Rest of the first candidate that continues what was typed after base
+    if (!text.startsWith(base)) {
+        return "";
+    }
+    const typed = text.slice(base.length);
+    for (const candidate of candidates) {
+        if (candidate.startsWith(typed)) {
+            const remainder = candidate.slice(typed.length).trim();
+            if (remainder) {
+                return remainder;
+            }
         }
-    }, 1000);
+    }
+    return "";
+}
+
+function diffText(oldText, newText) {
+    // Single edit turning oldText into newText: common prefix and suffix kept
+    let start = 0;
+    const maxPrefix = Math.min(oldText.length, newText.length);
+    while (start < maxPrefix && oldText[start] === newText[start]) {
+        start++;
+    }
+    let suffix = 0;
+    const maxSuffix = maxPrefix - start;
+    while (
+        suffix < maxSuffix &&
+        oldText[oldText.length - 1 - suffix] === newText[newText.length - 1 - suffix]
+    ) {
+        suffix++;
+    }
+    return {
+        start,
+        delete: oldText.length - start - suffix,
+        insert: newText.slice(start, newText.length - suffix),
+    };
+}
+
+async function postJson(url, body) {
+    const response = await fetch(url, {
+        method: "POST",
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify(body),
+    });
+    const data = await response.json();
+    return { status: response.status, data };
 }
 
-async function fetchSuggestion(subject, textSoFar) {
-    try {
-        const response = await fetch("http://127.0.0.1:5000/autocomplete", {
-            method: "POST",
-            headers: { "Content-Type": "application/json" },
-            body: JSON.stringify({ subject, text_so_far: textSoFar }),
+class SuggestionSession {
+    // Delta protocol with the model server: the server keeps the email text,
+    // the client sends numbered edits and suggestions are pushed back over
+    // Server-Sent Events.
+
+    constructor(subject, onSuggestion) {
+        this.subject = subject;
+        this.onSuggestion = onSuggestion;
+        this.serverUrl = SERVER_URL; // Where the session lives
+        this.sessionId = null;
+        this.events = null;
+        this.seq = 0; // Last edit acknowledged by the server
+        this.syncedText = ""; // Email text as the server has it
+        this.pendingEvent = null; // Suggestion for an edit not yet acknowledged
+        this.queue = Promise.resolve(); // Edits are sent one at a time, in order
+    }
+
+    async open() {
+        const { status, data } = await postJson(`${SERVER_URL}/session`, {
+            subject: this.subject,
         });
+        if (status !== 200) {
+            throw new Error(`HTTP error! Status: ${status}`);
+        }
+        // Under serve.py the session lives in the worker that created it
+        this.serverUrl = data.session_url || SERVER_URL;
+        this.sessionId = data.session_id;
+        this.seq = data.seq;
+        this.syncedText = "";
+        this.pendingEvent = null;
 
-        if (!response.ok) {
-            throw new Error(`HTTP error! Status: ${response.status}`);
+        if (this.events) {
+            this.events.close();
         }
+        this.events = new EventSource(
+            `${this.serverUrl}/session/${this.sessionId}/events?num_candidates=${NUM_CANDIDATES}`
+        );
+        this.events.onmessage = (event) => {
+            this.pendingEvent = JSON.parse(event.data);
+            this.deliver();
+        };
+    }
 
-        const data = await response.json();
-        return data.suggestion || "";
-    } catch (error) {
-        console.error("Error fetching suggestion:", error);
-        return ""; // Fallback to no suggestion
+    deliver() {
+        // The server can answer a fast suggestion before the delta POST that
+        // requested it resolves, so an event for a newer seq is held until
+        // the edit is acknowledged. Events for older seqs are stale.
+        const data = this.pendingEvent;
+        if (!data || data.seq > this.seq) {
+            return;
+        }
+        this.pendingEvent = null;
+        if (data.seq === this.seq && data.suggestion) {
+            const candidates = data.candidates || [{ text: data.suggestion }];
+            this.onSuggestion(
+                candidates.map((candidate) => candidate.text),
+                this.syncedText
+            );
+        }
+    }
+
+    sync(text, suggest) {
+        this.enqueue(() => this.sendDelta(text, suggest, false));
+    }
+
+    setSubject(subject) {
+        this.subject = subject;
+        this.enqueue(() => this.sendDelta(this.syncedText, false, true));
+    }
+
+    close() {
+        if (this.events) {
+            this.events.close();
+        }
+        if (this.sessionId) {
+            fetch(`${this.serverUrl}/session/${this.sessionId}`, {
+                method: "DELETE",
+                keepalive: true,
+            });
+        }
+    }
+
+    enqueue(task) {
+        this.queue = this.queue
+            .then(task)
+            .catch((error) => console.error("Error syncing with server:", error));
+    }
+
+    postDelta(delta) {
+        return postJson(`${this.serverUrl}/session/${this.sessionId}/delta`, delta);
+    }
+
+    async sendDelta(text, suggest, subjectChanged) {
+        if (!this.sessionId) {
+            await this.open();
+        }
+        const edit = diffText(this.syncedText, text);
+        if (!edit.delete && !edit.insert && !suggest && !subjectChanged) {
+            return; // Nothing changed
+        }
+
+        const delta = { seq: this.seq + 1, ...edit, suggest };
+        if (subjectChanged) {
+            delta.subject = this.subject;
+        }
+        let { status, data } = await this.postDelta(delta);
+
+        if (status === 404) {
+            // Session expired or the server restarted: start over with the full text
+            await this.open();
+            ({ status, data } = await this.postDelta({
+                seq: this.seq + 1,
+                start: 0,
+                delete: 0,
+                insert: text,
+                subject: this.subject,
+                suggest,
+            }));
+        } else if (status === 409) {
+            // Out of sync: replace the server's text with ours
+            ({ status, data } = await this.postDelta({
+                seq: data.seq + 1,
+                start: 0,
+                delete: data.length,
+                insert: text,
+                subject: this.subject,
+                suggest,
+            }));
+        }
+
+        if (status !== 200) {
+            throw new Error(`HTTP error! Status: ${status}`);
+        }
+        this.seq = data.seq;
+        this.syncedText = text;
+        this.deliver();
     }
 }
 
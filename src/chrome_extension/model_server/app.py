@@ -1,13 +1,27 @@
-# src/chrome_extension/model_server/app.py
-from flask import Flask, request, jsonify
+from cachetools import LRUCache
+from flask import Flask, request, jsonify, Response
 from flask_cors import CORS
+from urllib.parse import urlsplit
+import json
+import logging
+import math
 import os
-from transformers import AutoTokenizer, AutoModelForSeq2SeqLM
-import torch
+import random
+import socket
+import socketserver
+import sys
+import threading
+import time
+
+import metrics
+from sessions import SequenceError, SessionStore
+from user_models import IncompatibleAdapterError, UnknownUserError, UserModelCache
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
 
+logger = logging.getLogger("autocomplete")
+
 
 # Load the model
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -16,36 +30,520 @@ MODEL_PATH = os.path.join(
     PROJECT_ROOT, "src/transformers/fine_tuned_model_email_writer"
 )
 
-tokenizer = AutoTokenizer.from_pretrained(MODEL_PATH)
-model = AutoModelForSeq2SeqLM.from_pretrained(MODEL_PATH)
+sys.path.append(os.path.join(PROJECT_ROOT, "src/common"))
+from context_window import build_input_text
+from decoding_profiles import get_profile
+from local_socket import default_socket_path, is_own_socket
+from model_loader import ModelLoader
+from phrase_index import PhraseIndex
+from speculative_decoding import TokenNgramDraft, speculative_generate
+
+# Number of warmup generations to run before reporting ready (0 disables)
+WARMUP_RUNS = int(os.environ.get("WARMUP_RUNS", "1"))
+# Number of recent prompts whose suggestions are kept
+SUGGESTION_CACHE_SIZE = int(os.environ.get("SUGGESTION_CACHE_SIZE", "1024"))
+# Phrase index built from sent mail, used to skip the model for stock phrases
+PHRASE_INDEX_PATH = os.environ.get(
+    "PHRASE_INDEX_PATH", os.path.join(PROJECT_ROOT, "src/gcloud/phrase_index.pkl")
+)
+# Named generate arguments from decoding_profiles.py
+DECODING_PROFILE = get_profile(os.environ.get("DECODING_PROFILE", "beam5"))
+# "generate" to decode with DECODING_PROFILE, or "speculative" for greedy
+# decoding (up to the profile's max_length) sped up by a draft built from the
+# sent mail in DRAFT_CORPUS_PATH
+DECODING_MODE = os.environ.get("DECODING_MODE", "generate")
+DRAFT_CORPUS_PATH = os.environ.get(
+    "DRAFT_CORPUS_PATH", os.path.join(PROJECT_ROOT, "src/gcloud/threads.json")
+)
+# Per-user fine-tuned models or adapters, one subdirectory per user id
+USER_MODELS_DIR = os.environ.get(
+    "USER_MODELS_DIR", os.path.join(PROJECT_ROOT, "src/transformers/user_models")
+)
+# Memory budget for loaded per-user weights. This applies to each process, so
+# under serve.py the total is this times the number of workers.
+USER_MODEL_MEMORY_MB = int(os.environ.get("USER_MODEL_MEMORY_MB", "2048"))
+# Unix socket for local clients such as the terminal demo, in a directory
+# private to this user ("" disables)
+try:
+    UNIX_SOCKET_PATH = default_socket_path()
+except PermissionError as e:
+    print(f"Not serving local clients: {e}")
+    UNIX_SOCKET_PATH = ""
+# Most candidates returned per request, larger requests are capped. More than
+# one candidate needs a beam search at least that wide, so by default this is
+# the profile's beam width in "generate" mode and 1 otherwise, and requests are
+# always decoded as configured. A larger value replaces DECODING_PROFILE's
+# search and DECODING_MODE for requests that ask for more candidates (counted
+# in autocomplete_decoding_overrides_total).
+CONFIGURED_CANDIDATES = (
+    DECODING_PROFILE.get("num_beams", 1) if DECODING_MODE == "generate" else 1
+)
+MAX_CANDIDATES = int(os.environ.get("MAX_CANDIDATES", CONFIGURED_CANDIDATES))
+if MAX_CANDIDATES > CONFIGURED_CANDIDATES:
+    logger.warning(
+        "MAX_CANDIDATES=%d is above %d, so larger requests use a beam search "
+        "instead of the configured decoding",
+        MAX_CANDIDATES,
+        CONFIGURED_CANDIDATES,
+    )
+# Seconds between keepalive comments on idle suggestion streams
+SSE_KEEPALIVE_SECONDS = 15
+# Fraction of requests logged with a per-stage trace (0 disables)
+TRACE_SAMPLE_RATE = float(os.environ.get("TRACE_SAMPLE_RATE", "0"))
+
+loader = ModelLoader(MODEL_PATH, warmup_runs=WARMUP_RUNS)
+user_models = UserModelCache(USER_MODELS_DIR, loader, USER_MODEL_MEMORY_MB * 2**20)
+
+# Suggestions keyed by user id and the exact model prompt
+suggestion_cache = LRUCache(maxsize=SUGGESTION_CACHE_SIZE)
+cache_lock = threading.Lock()
+
+phrase_index = None
+phrase_index_mtime = None
+phrase_index_lock = threading.Lock()
+
+draft = None
+draft_built = False  # Whether building the draft has been attempted
+draft_lock = threading.Lock()
+
+sessions = SessionStore()
+
+# One generation at a time, concurrent generate calls only fight over cores
+generate_lock = threading.Lock()
+
+
+@app.route("/healthz", methods=["GET"])
+def healthz():
+    """Liveness: the process is up and serving HTTP."""
+    return jsonify({"status": "ok"})
+
+
+@app.route("/readyz", methods=["GET"])
+def readyz():
+    """Readiness: the model is loaded and warmed up."""
+    if not loader.is_ready():
+        loader.load_in_background()
+        status = "error" if loader.error else "loading"
+        return jsonify({"status": status}), 503
+    return jsonify({"status": "ready", "timings": loader.timings})
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    """Prometheus text exposition of the server metrics."""
+    return Response(metrics.REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
+
+def current_phrase_index():
+    """The phrase index, reloaded whenever the file on disk changes."""
+    global phrase_index, phrase_index_mtime
+    try:
+        mtime = os.stat(PHRASE_INDEX_PATH).st_mtime
+    except OSError:
+        return None  # No index built yet
+    if mtime != phrase_index_mtime:
+        with phrase_index_lock:
+            if mtime != phrase_index_mtime:
+                try:
+                    phrase_index = PhraseIndex.load(PHRASE_INDEX_PATH)
+                except Exception as e:
+                    # Keep the previous index, or fall back to the model
+                    logger.warning("Could not load phrase index: %s", e)
+                phrase_index_mtime = mtime
+    return phrase_index
+
+
+def current_draft():
+    """
+    The speculative decoding draft, built from the sent mail on first use.
+
+    Returns None if the sent mail cannot be read, in which case requests are
+    decoded with `generate` instead.
+    """
+    global draft, draft_built
+    with draft_lock:
+        if not draft_built:
+            draft_built = True
+            try:
+                with open(DRAFT_CORPUS_PATH, "r", encoding="utf-8") as file:
+                    threads = json.load(file)
+            except (OSError, ValueError) as e:
+                logger.warning("No speculative decoding draft, using generate: %s", e)
+            else:
+                draft = TokenNgramDraft.from_texts(
+                    loader.tokenizer, (thread.get("body", "") for thread in threads)
+                )
+    return draft
+
+
+def prepare_draft():
+    """Build the draft once the model is ready, rather than on the first request."""
+    if DECODING_MODE == "speculative":
+        loader.wait_until_ready()
+        current_draft()
+
+
+def generate_suggestion(input_text, trace, user_id=None, num_candidates=1):
+    """
+    Run the model on a prompt, recording per-stage timings.
+
+    Parameters:
+    - input_text: The tagged model prompt.
+    - trace: Dict that per-stage timings and token counts are added to.
+    - user_id: Whose fine-tuned weights to use (None for the default model).
+    - num_candidates: Number of ranked alternatives to return.
+
+    Returns:
+    - List of {"text", "score"} candidates, best first. The score is the beam
+      search log-likelihood, or None for a single candidate.
+    """
+    import torch
+
+    tokenizer = loader.tokenizer
+
+    start = time.perf_counter()
+    inputs = tokenizer(input_text, return_tensors="pt")
+    trace["tokenize_seconds"] = time.perf_counter() - start
+    trace["input_tokens"] = inputs.input_ids.shape[1]
+
+    # Built (once) outside the generate lock
+    speculative_draft = current_draft() if DECODING_MODE == "speculative" else None
+
+    metrics.QUEUE_DEPTH.inc()
+    with generate_lock:
+        metrics.QUEUE_DEPTH.dec()
+        metrics.BATCH_SIZE.set(inputs.input_ids.shape[0])
+        start = time.perf_counter()
+        with user_models.activate(user_id) as model:
+            trace["activate_seconds"] = time.perf_counter() - start
+            start = time.perf_counter()
+            scores = [None]
+            if num_candidates > 1:
+                # One beam search ranks the alternatives, with at least as many
+                # beams as candidates
+                if (
+                    DECODING_MODE == "speculative"
+                    or DECODING_PROFILE.get("num_beams", 1) < num_candidates
+                ):
+                    trace["decoding_override"] = True
+                    metrics.DECODING_OVERRIDES.inc()
+                generate_kwargs = dict(
+                    DECODING_PROFILE,
+                    num_beams=max(DECODING_PROFILE.get("num_beams", 1), num_candidates),
+                    num_return_sequences=num_candidates,
+                    output_scores=True,
+                    return_dict_in_generate=True,
+                )
+                with torch.no_grad():
+                    outputs = model.generate(
+                        input_ids=inputs.input_ids, **generate_kwargs
+                    )
+                output_ids = outputs.sequences
+                scores = outputs.sequences_scores.tolist()
+            elif speculative_draft is not None:
+                output_ids, stats = speculative_generate(
+                    model,
+                    inputs.input_ids,
+                    speculative_draft,
+                    max_length=DECODING_PROFILE["max_length"],
+                )
+                trace.update(stats)
+            else:
+                with torch.no_grad():
+                    output_ids = model.generate(
+                        input_ids=inputs.input_ids, **DECODING_PROFILE
+                    )
+        trace["generate_seconds"] = time.perf_counter() - start
+    trace["output_tokens"] = output_ids.shape[1]
+
+    start = time.perf_counter()
+    texts = tokenizer.batch_decode(output_ids, skip_special_tokens=True)
+    candidates = []
+    for text, score in zip(texts, scores):
+        # Beams that differ only in special tokens decode to the same text
+        if text not in (candidate["text"] for candidate in candidates):
+            candidates.append({"text": text, "score": score})
+    trace["decode_seconds"] = time.perf_counter() - start
+
+    metrics.TOKENIZE_SECONDS.observe(trace["tokenize_seconds"])
+    metrics.GENERATE_SECONDS.observe(trace["generate_seconds"])
+    metrics.DECODE_SECONDS.observe(trace["decode_seconds"])
+    metrics.INPUT_TOKENS.observe(trace["input_tokens"])
+    metrics.OUTPUT_TOKENS.observe(trace["output_tokens"])
+    return candidates
+
+
+def suggest(subject, text_so_far, trace, user_id=None, num_candidates=1):
+    """
+    Suggest a completion from the phrase index, the suggestion cache or the model.
+
+    Parameters:
+    - subject: Email subject line.
+    - text_so_far: The email body typed so far.
+    - trace: Dict that the suggestion source and timings are added to.
+    - user_id: Whose fine-tuned weights to use (None for the default model).
+    - num_candidates: Number of ranked alternatives wanted from the model.
+
+    Returns:
+    - List of {"text", "score"} candidates, best first.
+    """
+    # The phrase index is built from the default user's mail only
+    index = current_phrase_index() if not user_id else None
+    if index is not None:
+        suggestion, confidence = index.lookup(text_so_far)
+        if suggestion is not None:
+            # Stock phrase the user has written many times, skip the model
+            trace.update(source="phrase_index", confidence=confidence)
+            metrics.PHRASE_INDEX_HITS.inc()
+            return [{"text": suggestion, "score": math.log(confidence)}]
+
+    # Prepare input, keeping only a bounded window of the email so far
+    input_text = build_input_text(subject, text_so_far)
+    trace["input_text"] = input_text
+
+    cache_key = (user_id, input_text, num_candidates)
+    with cache_lock:
+        candidates = suggestion_cache.get(cache_key)
+    if candidates is not None:
+        trace["source"] = "cache"
+        metrics.CACHE_HITS.inc()
+        return candidates
+
+    trace["source"] = "model"
+    candidates = generate_suggestion(input_text, trace, user_id, num_candidates)
+    with cache_lock:
+        suggestion_cache[cache_key] = candidates
+    return candidates
+
+
+def handle_autocomplete(data):
+    """
+    Answer an autocomplete request from any transport.
+
+    Parameters:
+    - data: Request dict with subject, text_so_far and optional user_id and
+      num_candidates.
+
+    Returns:
+    - (response dict, HTTP status code). The response has the best
+      "suggestion", plus ranked "candidates" when num_candidates > 1.
+    """
+    metrics.REQUESTS.inc()
+    num_candidates = data.get("num_candidates", 1)
+    if not isinstance(num_candidates, int) or num_candidates < 1:
+        return {"error": "num_candidates must be a positive integer"}, 400
+    num_candidates = min(num_candidates, MAX_CANDIDATES)
+
+    if not loader.is_ready():
+        loader.load_in_background()
+        return {"error": "Model is still loading"}, 503
+
+    start = time.perf_counter()
+    subject = data.get("subject", "")
+    text_so_far = data.get("text_so_far", "")
+    user_id = data.get("user_id")
+
+    trace = {"user_id": user_id}
+    try:
+        candidates = suggest(subject, text_so_far, trace, user_id, num_candidates)
+    except UnknownUserError as e:
+        return {"error": str(e)}, 404
+    except IncompatibleAdapterError as e:
+        logger.warning("%s", e)
+        return {"error": str(e)}, 409
+    except Exception:
+        metrics.ERRORS.inc()
+        raise
+
+    trace["request_seconds"] = time.perf_counter() - start
+    metrics.REQUEST_SECONDS.observe(trace["request_seconds"])
+    if TRACE_SAMPLE_RATE and random.random() < TRACE_SAMPLE_RATE:
+        trace["candidates"] = candidates
+        logger.info("trace %s", json.dumps(trace))
+
+    response = {"suggestion": candidates[0]["text"]}
+    if num_candidates > 1:
+        response["candidates"] = candidates
+    return response, 200
 
 
 @app.route("/autocomplete", methods=["POST"])
 def autocomplete():
-    data = request.json
-    subject = data.get("subject", "") if data else ""
-    text_so_far = data.get("text_so_far", "") if data else ""
+    data = dict(request.json or {})
+    data["user_id"] = data.get("user_id") or request.headers.get("X-User-Id")
+    response, status = handle_autocomplete(data)
+    return jsonify(response), status
 
-    # Prepare input
-    input_text = f"[SUBJECT] {subject}\n[TEXT SO FAR] {text_so_far.strip()}"
-    inputs = tokenizer(input_text, return_tensors="pt")
 
-    print(f"Generating completion for input text: {input_text}")
+@app.route("/session", methods=["POST"])
+def create_session():
+    """
+    Open an editing session for the delta protocol.
 
-    # Generate output
-    with torch.no_grad():
-        output_ids = model.generate(
-            inputs.input_ids,
-            max_length=50,
-            num_beams=5,
-            early_stopping=True,
+    Under serve.py the response includes "session_url", this worker's own
+    session port on the host the client connected to, where the client must
+    send the rest of the session.
+    """
+    data = request.json or {}
+    user_id = data.get("user_id") or request.headers.get("X-User-Id")
+    session = sessions.create(data.get("subject", ""), user_id)
+    response = {"session_id": session.session_id, "seq": session.seq}
+    session_port = app.config.get("SESSION_PORT")
+    if session_port:
+        # Not the bind address, which may be a wildcard such as 0.0.0.0
+        host = urlsplit(request.host_url).hostname
+        if ":" in host:
+            host = f"[{host}]"  # IPv6
+        response["session_url"] = f"{request.scheme}://{host}:{session_port}"
+    return jsonify(response)
+
+
+@app.route("/session/<session_id>", methods=["DELETE"])
+def close_session(session_id):
+    if sessions.close(session_id) is None:
+        return jsonify({"error": "Unknown session"}), 404
+    return jsonify({"status": "closed"})
+
+
+@app.route("/session/<session_id>/delta", methods=["POST"])
+def session_delta(session_id):
+    """Apply one edit to the session text, optionally requesting a suggestion."""
+    session = sessions.get(session_id)
+    if session is None:
+        return jsonify({"error": "Unknown session"}), 404
+    try:
+        seq = session.apply(request.json or {})
+    except SequenceError as e:
+        # The client resends its full text as the next seq
+        return (
+            jsonify({"error": str(e), "seq": session.seq, "length": len(session.text)}),
+            409,
         )
-    suggestion = tokenizer.decode(output_ids[0], skip_special_tokens=True)
+    return jsonify({"seq": seq})
+
+
+@app.route("/session/<session_id>/events", methods=["GET"])
+def session_events(session_id):
+    """
+    Server-Sent Events stream of suggestions for a session.
+
+    Each event is {"seq", "suggestion"} (or {"seq", "error"}) for the latest
+    delta that requested a suggestion, with "candidates" when the stream was
+    opened with ?num_candidates=N. Requests superseded by newer edits before
+    or during generation are dropped and counted as cancellations.
+    """
+    session = sessions.get(session_id)
+    if session is None:
+        return jsonify({"error": "Unknown session"}), 404
+    num_candidates = request.args.get("num_candidates", 1, type=int)
+
+    def stream():
+        handled_seq = 0
+        while True:
+            with session.condition:
+                while not session.closed and session.suggest_seq == handled_seq:
+                    if not session.condition.wait(SSE_KEEPALIVE_SECONDS):
+                        break
+                if session.closed:
+                    return
+                seq = session.suggest_seq
+                superseded = session.seq != seq
+                data = {
+                    "subject": session.subject,
+                    "text_so_far": session.text,
+                    "user_id": session.user_id,
+                    "num_candidates": num_candidates,
+                }
+
+            if seq == handled_seq:
+                yield ": keepalive\n\n"
+                continue
+            handled_seq = seq
+            if superseded:
+                metrics.CANCELLATIONS.inc()  # Text changed before we started
+                continue
+
+            try:
+                response, _ = handle_autocomplete(data)
+            except Exception:
+                # Already counted as an error, keep the stream open for later edits
+                logger.exception("Suggestion for session %s failed", session_id)
+                error = {"seq": seq, "error": "Suggestion failed"}
+                yield f"data: {json.dumps(error)}\n\n"
+                continue
+            with session.condition:
+                superseded = session.seq != seq
+            if superseded:
+                metrics.CANCELLATIONS.inc()  # Text changed while generating
+                continue
+            yield f"data: {json.dumps(dict(response, seq=seq))}\n\n"
+
+    return Response(
+        stream(), mimetype="text/event-stream", headers={"Cache-Control": "no-cache"}
+    )
+
+
+class LocalRequestHandler(socketserver.StreamRequestHandler):
+    """
+    Autocomplete for local clients over a persistent Unix socket connection.
+
+    Each request is one line of JSON, {"subject", "text_so_far", "user_id"},
+    answered with one line {"suggestion"} or {"error", "status"}. Without HTTP
+    framing or reconnects per request, this is cheaper than /autocomplete for
+    clients on the same machine such as the terminal demo.
+    """
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                response, status = handle_autocomplete(json.loads(line))
+            except Exception as e:
+                response, status = {"error": str(e)}, 500
+            if status != 200:
+                response["status"] = status
+            self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+            self.wfile.flush()
+
+
+def remove_stale_socket(path):
+    """Remove a socket left by an earlier run, refusing anyone else's file."""
+    if is_own_socket(path):
+        os.unlink(path)
+    elif os.path.lexists(path):
+        raise PermissionError(f"{path} exists and is not our own socket")
+
 
-    print(f"Generated suggestion: {suggestion}")
+def serve_unix_socket(path, fd=None):
+    """
+    Serve LocalRequestHandler on a Unix socket from a daemon thread.
 
-    return jsonify({"suggestion": suggestion})
+    Parameters:
+    - path: Socket path, replaced if a stale socket is left there.
+    - fd: Already listening socket to serve on (used by serve.py workers).
+    """
+    if fd is None:
+        remove_stale_socket(path)
+    server = socketserver.ThreadingUnixStreamServer(
+        path, LocalRequestHandler, bind_and_activate=fd is None
+    )
+    if fd is None:
+        os.chmod(path, 0o600)
+    if fd is not None:
+        server.socket.close()
+        server.socket = socket.fromfd(fd, socket.AF_UNIX, socket.SOCK_STREAM)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
 
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    # The debug reloader re-runs this module in a child process which does the
+    # serving, so only start loading the model there
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        loader.load_in_background()
+        threading.Thread(target=prepare_draft, daemon=True).start()
+        if UNIX_SOCKET_PATH:
+            serve_unix_socket(UNIX_SOCKET_PATH)
     app.run(port=5000, debug=True)
@@ -0,0 +1,197 @@
+# Minimal Prometheus-style metrics for the model server.
+#
+# Implements just enough of the text exposition format for /metrics without an
+# extra dependency. Values live in shared memory allocated when a metric is
+# created, at import time. serve.py imports this module before forking its
+# workers, so all workers update the same values and any of them can answer a
+# scrape with the totals for the whole server.
+import bisect
+import multiprocessing
+
+# Latency buckets in seconds, from sub-millisecond cache hits to slow beams
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+TOKEN_BUCKETS = (8, 16, 32, 64, 128, 256, 512)
+
+
+def format_value(value):
+    """Whole numbers without a trailing .0, as counts are usually shown."""
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+class Metric:
+    """
+    Base class for a single named metric.
+
+    `values` is a shared array of `size` doubles, guarded by a lock that also
+    works across forked processes.
+    """
+
+    type_name = "untyped"
+
+    def __init__(self, name, documentation, size=1):
+        self.name = name
+        self.documentation = documentation
+        self.values = multiprocessing.RawArray("d", size)
+        self._lock = multiprocessing.Lock()
+
+    def render(self):
+        """Lines of the text exposition format for this metric."""
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type_name}",
+        ] + self._samples()
+
+    def _samples(self):
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    """Monotonically increasing count."""
+
+    type_name = "counter"
+
+    @property
+    def value(self):
+        return self.values[0]
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.values[0] += amount
+
+    def _samples(self):
+        return [f"{self.name} {format_value(self.value)}"]
+
+
+class Gauge(Metric):
+    """
+    Value that can go up and down.
+
+    Across workers, inc and dec add up (e.g. the total queue depth) and set
+    keeps the last value written by any worker.
+    """
+
+    type_name = "gauge"
+
+    @property
+    def value(self):
+        return self.values[0]
+
+    def set(self, value):
+        with self._lock:
+            self.values[0] = value
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.values[0] += amount
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def _samples(self):
+        return [f"{self.name} {format_value(self.value)}"]
+
+
+class Histogram(Metric):
+    """Distribution of observed values in cumulative buckets."""
+
+    type_name = "histogram"
+
+    def __init__(self, name, documentation, buckets=LATENCY_BUCKETS):
+        # One count per bucket, +Inf, then the sum and count of observations
+        super().__init__(name, documentation, size=len(buckets) + 3)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value):
+        with self._lock:
+            self.values[bisect.bisect_left(self.buckets, value)] += 1
+            self.values[-2] += value
+            self.values[-1] += 1
+
+    def _samples(self):
+        with self._lock:
+            values = list(self.values)
+        samples = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + ("+Inf",), values):
+            cumulative += count
+            samples.append(
+                f'{self.name}_bucket{{le="{bound}"}} {format_value(cumulative)}'
+            )
+        samples.append(f"{self.name}_sum {format_value(values[-2])}")
+        samples.append(f"{self.name}_count {format_value(values[-1])}")
+        return samples
+
+
+class Registry:
+    """Collection of metrics rendered together on /metrics."""
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+REQUESTS = REGISTRY.register(
+    Counter("autocomplete_requests_total", "Autocomplete requests received.")
+)
+CACHE_HITS = REGISTRY.register(
+    Counter("autocomplete_cache_hits_total", "Suggestions served from the cache.")
+)
+PHRASE_INDEX_HITS = REGISTRY.register(
+    Counter(
+        "autocomplete_phrase_index_hits_total",
+        "Suggestions served from the phrase index without the model.",
+    )
+)
+CANCELLATIONS = REGISTRY.register(
+    Counter(
+        "autocomplete_cancellations_total",
+        "Requests dropped because newer input superseded them.",
+    )
+)
+ERRORS = REGISTRY.register(
+    Counter("autocomplete_errors_total", "Requests that failed with an error.")
+)
+DECODING_OVERRIDES = REGISTRY.register(
+    Counter(
+        "autocomplete_decoding_overrides_total",
+        "Model runs that used beam search for top-N candidates instead of the "
+        "configured decoding profile or mode.",
+    )
+)
+QUEUE_DEPTH = REGISTRY.register(
+    Gauge("autocomplete_queue_depth", "Requests waiting for the model.")
+)
+BATCH_SIZE = REGISTRY.register(
+    Gauge("autocomplete_batch_size", "Sequences in the last generate call.")
+)
+REQUEST_SECONDS = REGISTRY.register(
+    Histogram("autocomplete_request_seconds", "Total autocomplete handling time.")
+)
+TOKENIZE_SECONDS = REGISTRY.register(
+    Histogram("autocomplete_tokenize_seconds", "Time spent tokenizing the prompt.")
+)
+GENERATE_SECONDS = REGISTRY.register(
+    Histogram("autocomplete_generate_seconds", "Time spent in model.generate.")
+)
+DECODE_SECONDS = REGISTRY.register(
+    Histogram("autocomplete_decode_seconds", "Time spent decoding the output.")
+)
+INPUT_TOKENS = REGISTRY.register(
+    Histogram("autocomplete_input_tokens", "Prompt length in tokens.", TOKEN_BUCKETS)
+)
+OUTPUT_TOKENS = REGISTRY.register(
+    Histogram(
+        "autocomplete_output_tokens", "Generated length in tokens.", TOKEN_BUCKETS
+    )
+)
@@ -0,0 +1,264 @@
+"""
+Multi-worker production server for the autocomplete model.
+
+The master process loads the model once and then forks worker processes that
+accept connections on a shared listening socket. The weights are never
+written after loading, so the workers share them with the master
+copy-on-write instead of each holding their own copy. torch intra-op threads
+are split between the workers so they do not oversubscribe the cores.
+
+Delta-protocol sessions (see sessions.py) live in process memory. Each
+worker also listens on a session port of its own (--session-port plus the
+worker's index). POST /session on the shared port creates the session in
+whichever worker accepts it and returns that worker's session URL. The client
+sends the rest of the session there, so sessions spread over all workers.
+
+Usage:
+    python serve.py --workers 4 --port 5000
+"""
+
+import argparse
+import gc
+import logging
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+
+from werkzeug.serving import make_server
+
+# A worker that keeps dying before it is ready (bad port, failing model load)
+# is restarted with exponential backoff, up to this many times in a row
+MAX_EARLY_FAILURES = 5
+MAX_BACKOFF_SECONDS = 30
+
+from app import (
+    app,
+    loader,
+    prepare_draft,
+    remove_stale_socket,
+    serve_unix_socket,
+    UNIX_SOCKET_PATH,
+)
+
+
+def available_cpus():
+    """Number of CPUs this process may run on."""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def read_memory_kb(pid):
+    """
+    Read memory usage of a process from /proc (Linux only).
+
+    Returns:
+    - Dict with rss, pss and private (unique to the process) sizes in kB, or
+      None if /proc is not available.
+    """
+    try:
+        with open(f"/proc/{pid}/smaps_rollup", "r") as file:
+            fields = {}
+            for line in file:
+                parts = line.split()
+                if len(parts) == 3 and parts[2] == "kB":
+                    fields[parts[0].rstrip(":")] = int(parts[1])
+    except OSError:
+        return None
+    return {
+        "rss": fields.get("Rss", 0),
+        "pss": fields.get("Pss", 0),
+        "private": fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0),
+    }
+
+
+def run_worker(listen_socket, unix_socket, session_socket, threads, ready_fd):
+    """Serve requests in a forked worker process. Never returns."""
+    import torch
+
+    torch.set_num_threads(threads)
+    # Sessions created here are continued on this worker's own port
+    session_host, session_port = session_socket.getsockname()[:2]
+    app.config["SESSION_PORT"] = session_port
+
+    # Warm up in the worker rather than the master, OpenMP thread pools do
+    # not survive a fork
+    loader.warmup()
+    os.write(ready_fd, b"1")
+    os.close(ready_fd)
+
+    if unix_socket is not None:
+        serve_unix_socket(unix_socket.getsockname(), fd=unix_socket.fileno())
+    # Threaded so long-lived suggestion streams do not block the worker,
+    # generation itself is still serialized by the app's generate lock
+    session_server = make_server(
+        session_host, session_port, app, threaded=True, fd=session_socket.fileno()
+    )
+    threading.Thread(target=session_server.serve_forever, daemon=True).start()
+    host, port = listen_socket.getsockname()[:2]
+    server = make_server(host, port, app, threaded=True, fd=listen_socket.fileno())
+    try:
+        server.serve_forever()
+    finally:
+        os._exit(0)
+
+
+def spawn_worker(listen_socket, unix_socket, session_socket, threads):
+    """
+    Fork a worker and wait until it is warmed up.
+
+    Returns:
+    - The worker's pid, or None if it exited before becoming ready.
+    """
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        run_worker(listen_socket, unix_socket, session_socket, threads, write_fd)
+
+    os.close(write_fd)
+    ready = os.read(read_fd, 1)
+    os.close(read_fd)
+    if not ready:
+        os.waitpid(pid, 0)
+        print(f"Worker {pid} exited before becoming ready")
+        return None
+    return pid
+
+
+def start_worker(worker, threads):
+    """Spawn a worker, retrying with backoff. Exits if it never becomes ready."""
+    for failures in range(MAX_EARLY_FAILURES):
+        if failures:
+            delay = min(2**failures, MAX_BACKOFF_SECONDS)
+            print(f"Retrying in {delay}s...")
+            time.sleep(delay)
+        pid = spawn_worker(*worker, threads)
+        if pid is not None:
+            return pid
+    sys.exit(f"Worker failed to start {MAX_EARLY_FAILURES} times in a row, giving up")
+
+
+def report_memory(master_pid, worker_pids):
+    """Print memory of the master and workers, and the cost per added worker."""
+    master = read_memory_kb(master_pid)
+    workers = [read_memory_kb(pid) for pid in worker_pids]
+    if master is None or None in workers:
+        print("Memory reporting needs /proc/<pid>/smaps_rollup (Linux)")
+        return
+
+    print(f"Master (pid {master_pid}): RSS {master['rss'] / 1024:.1f} MB")
+    for pid, memory in zip(worker_pids, workers):
+        print(
+            f"Worker (pid {pid}): RSS {memory['rss'] / 1024:.1f} MB, "
+            f"PSS {memory['pss'] / 1024:.1f} MB, "
+            f"private {memory['private'] / 1024:.1f} MB"
+        )
+    per_worker = sum(memory["private"] for memory in workers) / len(workers)
+    print(f"Memory per added worker: {per_worker / 1024:.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Multi-worker model server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument(
+        "--session-port",
+        type=int,
+        help="Session port of the first worker, the others use the following "
+        "ports (default: port + 1)",
+    )
+    parser.add_argument(
+        "--unix-socket",
+        default=UNIX_SOCKET_PATH,
+        help="Also serve local clients on this Unix socket ('' to disable)",
+    )
+    parser.add_argument(
+        "--threads-per-worker",
+        type=int,
+        help="torch intra-op threads per worker (default: CPUs / workers)",
+    )
+    args = parser.parse_args()
+    # Sampled request traces are logged at INFO level
+    logging.basicConfig(level=logging.INFO)
+
+    threads = args.threads_per_worker or max(1, available_cpus() // args.workers)
+    # Cap OpenMP before torch is imported so no process starts a full-size pool
+    os.environ.setdefault("OMP_NUM_THREADS", str(threads))
+
+    # Load the weights once in the master, warmup happens in each worker
+    warmup_runs = loader.warmup_runs
+    loader.warmup_runs = 0
+    print(f"Loading model from {loader.model_path}...")
+    loader.load()
+    loader.warmup_runs = warmup_runs
+    # Built before forking so the workers share it too
+    prepare_draft()
+
+    # Keep the loaded objects out of the garbage collector so collections in
+    # the workers do not touch (and copy) the shared pages
+    gc.collect()
+    gc.freeze()
+
+    listen_socket = socket.create_server((args.host, args.port), backlog=128)
+    # Bound here rather than in the workers, so a restarted worker takes over
+    # the same port
+    session_port = args.session_port or args.port + 1
+    session_sockets = [
+        socket.create_server((args.host, session_port + i), backlog=128)
+        for i in range(args.workers)
+    ]
+    unix_socket = None
+    if args.unix_socket:
+        remove_stale_socket(args.unix_socket)
+        unix_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        unix_socket.bind(args.unix_socket)
+        os.chmod(args.unix_socket, 0o600)
+        unix_socket.listen(128)
+    print(
+        f"Starting {args.workers} workers with {threads} threads each "
+        f"on http://{args.host}:{args.port}, sessions on ports "
+        f"{session_port}-{session_port + args.workers - 1}"
+    )
+    # pid -> arguments to respawn the worker with
+    worker_args = [
+        (listen_socket, unix_socket, session_socket)
+        for session_socket in session_sockets
+    ]
+    workers = {}
+
+    def stop_workers():
+        for pid in workers:
+            os.kill(pid, signal.SIGTERM)
+
+    def shutdown(signum, frame):
+        sys.exit(0)  # Workers are stopped below
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    try:
+        for worker in worker_args:
+            workers[start_worker(worker, threads)] = worker
+        report_memory(os.getpid(), sorted(workers))
+
+        # Replace workers that die
+        while True:
+            pid, status = os.wait()
+            if pid in workers:
+                worker = workers.pop(pid)
+                print(f"Worker {pid} exited with status {status}, restarting...")
+                workers[start_worker(worker, threads)] = worker
+    except SystemExit:
+        stop_workers()
+        raise
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+# Server-side editing sessions for the delta protocol between content.js and
+# the model server.
+#
+# The client opens a session once, then sends only the edits it makes to the
+# email, numbered with consecutive sequence numbers. The server keeps the full
+# text, so request size and parsing no longer grow with the email, and pushes
+# suggestions back over a Server-Sent Events stream. Sessions live in process
+# memory, so under serve.py the client continues a session on the port of the
+# worker that created it.
+import secrets
+import threading
+import time
+
+# Sessions idle for longer than this are dropped
+SESSION_TTL_SECONDS = 30 * 60
+
+
+class SequenceError(Exception):
+    """Raised when a delta is out of order or does not fit the session text."""
+
+
+def is_int(value):
+    # bool is a subclass of int, but true is not a valid offset
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+class Session:
+    """
+    Text of one email being written, updated by deltas.
+
+    `condition` guards all attributes and is notified when a suggestion is
+    requested or the session is closed.
+    """
+
+    def __init__(self, subject="", user_id=None):
+        self.session_id = secrets.token_urlsafe(16)
+        self.subject = subject
+        self.user_id = user_id
+        self.text = ""
+        self.seq = 0  # Sequence number of the last applied delta
+        self.suggest_seq = 0  # Latest seq a suggestion was requested for
+        self.closed = False
+        self.last_active = time.monotonic()
+        self.condition = threading.Condition()
+
+    def apply(self, delta):
+        """
+        Apply a delta {"seq", "start", "delete", "insert", "subject", "suggest"}.
+
+        `delete` characters at `start` are replaced by `insert`; a new `subject`
+        replaces the old one. Raises SequenceError if `seq` is not the next
+        sequence number, a field has the wrong type or the edit is out of range,
+        in which case the client should resend its full text.
+        """
+        if not isinstance(delta, dict):
+            raise SequenceError("Delta must be an object")
+        with self.condition:
+            if not is_int(delta.get("seq")) or delta["seq"] != self.seq + 1:
+                raise SequenceError(f"Expected seq {self.seq + 1}")
+            start = delta.get("start", len(self.text))
+            delete = delta.get("delete", 0)
+            insert = delta.get("insert", "")
+            subject = delta.get("subject", "")
+            if not (
+                is_int(start)
+                and is_int(delete)
+                and isinstance(insert, str)
+                and isinstance(subject, str)
+            ):
+                raise SequenceError("Delta has a field of the wrong type")
+            if not (
+                0 <= start <= len(self.text) and 0 <= delete <= len(self.text) - start
+            ):
+                raise SequenceError("Delta does not fit the session text")
+
+            self.text = self.text[:start] + insert + self.text[start + delete :]
+            if "subject" in delta:
+                self.subject = delta["subject"]
+            self.seq = delta["seq"]
+            self.last_active = time.monotonic()
+            if delta.get("suggest"):
+                self.suggest_seq = self.seq
+                self.condition.notify_all()
+            return self.seq
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+
+class SessionStore:
+    """Thread-safe registry of open sessions."""
+
+    def __init__(self, ttl_seconds=SESSION_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self.sessions = {}
+        self._lock = threading.Lock()
+
+    def create(self, subject="", user_id=None):
+        session = Session(subject, user_id)
+        with self._lock:
+            self._expire()
+            self.sessions[session.session_id] = session
+        return session
+
+    def get(self, session_id):
+        with self._lock:
+            return self.sessions.get(session_id)
+
+    def close(self, session_id):
+        with self._lock:
+            session = self.sessions.pop(session_id, None)
+        if session is not None:
+            session.close()
+        return session
+
+    def _expire(self):
+        now = time.monotonic()
+        for session_id, session in list(self.sessions.items()):
+            if now - session.last_active > self.ttl_seconds:
+                del self.sessions[session_id]
+                session.close()
@@ -0,0 +1,153 @@
+# Per-user fine-tuned weights for the model server, loaded lazily and kept in
+# an LRU within a memory budget.
+#
+# Each user's weights live in <models_dir>/<user_id>. A directory containing an
+# adapter_config.json holds a PEFT adapter (e.g. LoRA), which is loaded onto the
+# shared base model so a user costs only the adapter weights. Any other
+# directory holds a full fine-tuned checkpoint. All users are assumed to be
+# fine-tuned from the same base checkpoint, so they share its tokenizer.
+# Adapters record the checkpoint they were trained on, and are refused if that
+# is not the shared base model.
+import contextlib
+import gc
+import json
+import os
+import re
+from collections import OrderedDict
+
+# User ids map to directory names, so only allow safe characters
+USER_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+class UnknownUserError(Exception):
+    """Raised when a user has no weights in the models directory."""
+
+
+class IncompatibleAdapterError(Exception):
+    """Raised when a user's adapter was trained on a different base model."""
+
+
+def same_checkpoint(a, b):
+    """Whether two model names or paths refer to the same checkpoint."""
+    if os.path.isdir(a) and os.path.isdir(b):
+        return os.path.samefile(a, b)
+    return a.rstrip("/") == b.rstrip("/")
+
+
+class UserModelCache:
+    """
+    LRU of per-user adapters and models on top of a shared base model.
+
+    Not thread-safe: callers must serialize calls to `activate` and use of the
+    model it yields (the server does both under its generate lock), because
+    switching adapters changes the shared base model.
+
+    Parameters:
+    - models_dir: Directory with one subdirectory of weights per user.
+    - base_loader: ModelLoader for the shared base model.
+    - memory_budget_bytes: Total size of user weights kept loaded by this
+      process. Each serve.py worker has its own cache and budget.
+    """
+
+    def __init__(self, models_dir, base_loader, memory_budget_bytes):
+        self.models_dir = models_dir
+        self.base_loader = base_loader
+        self.memory_budget_bytes = memory_budget_bytes
+        self.entries = OrderedDict()  # user_id -> (kind, model, size in bytes)
+        self.peft_model = None  # Base model wrapped with all loaded adapters
+
+    def user_path(self, user_id):
+        """Directory holding a user's weights, or raise UnknownUserError."""
+        if not USER_ID_PATTERN.match(user_id or ""):
+            raise UnknownUserError(f"Invalid user id: {user_id!r}")
+        path = os.path.join(self.models_dir, user_id)
+        if not os.path.isdir(path):
+            raise UnknownUserError(f"No model for user {user_id!r}")
+        return path
+
+    def check_adapter_base(self, user_id, path):
+        """Raise IncompatibleAdapterError unless the adapter fits the base model."""
+        with open(os.path.join(path, "adapter_config.json"), encoding="utf-8") as f:
+            adapter_base = json.load(f).get("base_model_name_or_path")
+        model_base = self.base_loader.model.name_or_path
+        if adapter_base and same_checkpoint(adapter_base, model_base):
+            return
+        raise IncompatibleAdapterError(
+            f"Adapter for user {user_id!r} was trained on {adapter_base!r}, "
+            f"but the server's base model is {model_base!r}"
+        )
+
+    def memory_used(self):
+        return sum(size for _, _, size in self.entries.values())
+
+    @contextlib.contextmanager
+    def activate(self, user_id=None):
+        """
+        Yield the model to generate with for a user (None for the base model).
+
+        Loads the user's weights on first use and evicts the least recently
+        used users when over the memory budget.
+        """
+        base_model = self.base_loader.model
+        if not user_id:
+            if self.peft_model is None:
+                yield base_model
+            else:
+                # Adapters are injected into the base model's layers
+                with self.peft_model.disable_adapter():
+                    yield base_model
+            return
+
+        if user_id in self.entries:
+            self.entries.move_to_end(user_id)
+        else:
+            self.entries[user_id] = self._load(user_id)
+            self._evict()
+
+        kind, model, _ = self.entries[user_id]
+        if kind == "adapter":
+            self.peft_model.set_adapter(user_id)
+            yield self.peft_model
+        else:
+            yield model
+
+    def _load(self, user_id):
+        path = self.user_path(user_id)
+        if os.path.exists(os.path.join(path, "adapter_config.json")):
+            try:
+                from peft import PeftModel, get_peft_model_state_dict
+            except ImportError:
+                raise ImportError(
+                    "Loading per-user adapters requires peft: pip install peft"
+                )
+            self.check_adapter_base(user_id, path)
+            if self.peft_model is None:
+                self.peft_model = PeftModel.from_pretrained(
+                    self.base_loader.model, path, adapter_name=user_id
+                )
+            else:
+                self.peft_model.load_adapter(path, adapter_name=user_id)
+            self.peft_model.eval()
+            # Only this adapter's own tensors, not base weights whose names
+            # happen to contain the user id
+            state_dict = get_peft_model_state_dict(
+                self.peft_model, adapter_name=user_id
+            )
+            size = sum(t.numel() * t.element_size() for t in state_dict.values())
+            return ("adapter", None, size)
+
+        from transformers import AutoModelForSeq2SeqLM
+
+        model = AutoModelForSeq2SeqLM.from_pretrained(path, low_cpu_mem_usage=True)
+        model.eval()
+        size = sum(p.numel() * p.element_size() for p in model.parameters())
+        return ("model", model, size)
+
+    def _evict(self):
+        # Always keep the most recently used user, even if over budget
+        while len(self.entries) > 1 and self.memory_used() > self.memory_budget_bytes:
+            user_id, (kind, _, _) = self.entries.popitem(last=False)
+            if kind == "adapter":
+                self.peft_model.delete_adapter(user_id)
+            print(f"Evicted model for user {user_id}")
+        gc.collect()
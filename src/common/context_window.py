@@ -0,0 +1,60 @@
+# Bounded prompt context shared by the formatters and the model servers, so the
+# model is trained and served on exactly the same window of the email.
+
+# Number of [TEXT SO FAR] words kept in the prompt. At roughly 1.5 T5 subword
+# tokens per word this keeps the encoder input well under the 512 token limit.
+MAX_CONTEXT_WORDS = 128
+
+# Punctuation treated as the end of a sentence (matches split_into_sentences)
+SENTENCE_END = ".!?;:"
+
+
+def window_text_so_far(text_so_far, max_words=MAX_CONTEXT_WORDS):
+    """
+    Keep only the most recent words of the email, cut on a sentence boundary
+    if one falls within the first half of the window.
+
+    Only the tail of the text is scanned, so the cost is bounded by
+    `max_words` rather than by the length of the email.
+
+    Parameters:
+    - text_so_far: The email body typed so far.
+    - max_words: Maximum number of words to keep.
+
+    Returns:
+    - The windowed text. Text already within the window is returned stripped
+      but otherwise unchanged.
+    """
+    text_so_far = text_so_far.strip()
+    parts = text_so_far.rsplit(None, max_words)
+    if len(parts) <= max_words:
+        return text_so_far  # Already fits in the window
+
+    head, tail = parts[0], parts[1:]
+    if head[-1] in SENTENCE_END:  # Window already starts on a new sentence
+        return " ".join(tail)
+
+    # Drop the partial sentence at the start of the window, but only if that
+    # keeps at least half of the window
+    for i, word in enumerate(tail[: len(tail) // 2]):
+        if word[-1] in SENTENCE_END:
+            return " ".join(tail[i + 1 :])
+
+    # No sentence boundary early in the window, fall back to a plain word cut
+    return " ".join(tail)
+
+
+def build_input_text(subject, text_so_far, max_words=MAX_CONTEXT_WORDS):
+    """
+    Build the tagged model prompt from the subject and a window of the email.
+
+    Parameters:
+    - subject: Email subject line (always kept in full).
+    - text_so_far: The email body typed so far.
+    - max_words: Maximum number of [TEXT SO FAR] words to keep.
+
+    Returns:
+    - The prompt string used for both training and inference.
+    """
+    text_so_far = window_text_so_far(text_so_far, max_words)
+    return f"[SUBJECT] {subject}\n[TEXT SO FAR] {text_so_far}".strip()
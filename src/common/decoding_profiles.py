@@ -0,0 +1,28 @@
+# Named sets of `model.generate` arguments, shared by the model server and the
+# offline inference and evaluation scripts so results are comparable.
+#
+# The model server returns at most as many candidates as the profile has beams
+# (one for greedy profiles and speculative decoding), so the profile is always
+# followed. Raising MAX_CANDIDATES on the server lets requests for top-N
+# candidates (the Chrome extension asks for 5) run a beam search with at least
+# N beams and num_return_sequences=N instead.
+
+DECODING_PROFILES = {
+    # What the model server and terminal demo use
+    "beam5": {"max_length": 50, "num_beams": 5, "early_stopping": True},
+    # What demo_transformer_inference.py uses
+    "beam10": {"max_length": 100, "num_beams": 10, "early_stopping": True},
+    "greedy": {"max_length": 50, "num_beams": 1, "do_sample": False},
+    # Short greedy suggestions, the cheapest setting
+    "fast": {"max_length": 20, "num_beams": 1, "do_sample": False},
+}
+
+
+def get_profile(name):
+    """Copy of the generate arguments for a profile, or raise ValueError."""
+    if name not in DECODING_PROFILES:
+        raise ValueError(
+            f"Unknown decoding profile {name!r}, "
+            f"choose from {', '.join(DECODING_PROFILES)}"
+        )
+    return dict(DECODING_PROFILES[name])
@@ -0,0 +1,48 @@
+# Location and permissions of the model server's Unix socket.
+#
+# The socket lives in a directory only the current user can enter:
+# $XDG_RUNTIME_DIR when the session has one, otherwise a per-user directory
+# under the temp dir. A fixed path in /tmp could be created first by another
+# local user, who would then receive everything typed into the client.
+import os
+import stat
+import tempfile
+
+SOCKET_NAME = "cq-email-writer.sock"
+
+
+def private_dir(path):
+    """Create `path` with mode 0700, or check an existing one is ours alone."""
+    try:
+        os.mkdir(path, 0o700)
+    except FileExistsError:
+        pass
+    info = os.lstat(path)
+    if (
+        not stat.S_ISDIR(info.st_mode)
+        or info.st_uid != os.getuid()
+        or info.st_mode & 0o077
+    ):
+        raise PermissionError(f"{path} is not a directory private to this user")
+    return path
+
+
+def default_socket_path():
+    """Per-user socket path, overridable with $AUTOCOMPLETE_SOCKET."""
+    if os.environ.get("AUTOCOMPLETE_SOCKET") is not None:
+        return os.environ["AUTOCOMPLETE_SOCKET"]
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if not runtime_dir:
+        runtime_dir = private_dir(
+            os.path.join(tempfile.gettempdir(), f"cq-email-writer-{os.getuid()}")
+        )
+    return os.path.join(runtime_dir, SOCKET_NAME)
+
+
+def is_own_socket(path):
+    """Whether `path` is a socket owned by the current user."""
+    try:
+        info = os.lstat(path)
+    except OSError:
+        return False
+    return stat.S_ISSOCK(info.st_mode) and info.st_uid == os.getuid()
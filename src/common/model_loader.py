@@ -0,0 +1,118 @@
+# Shared, lazy model loading for the model server, terminal demo and demo scripts.
+#
+# torch and transformers take seconds to import, so they are only imported when
+# the model is first loaded. This lets servers bind their port and answer health
+# checks straight away while the model loads in the background.
+import os
+import threading
+import time
+
+DEFAULT_WARMUP_TEXT = "[SUBJECT] Quick question\n[TEXT SO FAR] Hi, I wanted to"
+
+
+class ModelLoader:
+    """
+    Load a fine-tuned seq2seq model and tokenizer on first use.
+
+    Safetensors checkpoints are preferred: the safetensors reader maps the file
+    into memory instead of unpickling it, and `low_cpu_mem_usage` skips the
+    randomly initialised copy of the weights. Once loaded, `warmup_runs`
+    generations are run so the first real request does not pay for lazy
+    initialisation inside torch before the loader reports itself ready.
+    """
+
+    def __init__(
+        self,
+        model_path,
+        warmup_text=DEFAULT_WARMUP_TEXT,
+        warmup_runs=1,
+        warmup_kwargs=None,
+    ):
+        self.model_path = model_path
+        self.warmup_text = warmup_text
+        self.warmup_runs = warmup_runs
+        self.warmup_kwargs = warmup_kwargs or {"max_length": 50, "num_beams": 5}
+        self.tokenizer = None
+        self.model = None
+        self.error = None
+        self.timings = {}
+        self._lock = threading.Lock()  # Held for the whole load
+        self._thread_lock = threading.Lock()  # Only guards starting the thread
+        self._ready = threading.Event()
+        self._thread = None
+
+    def is_ready(self):
+        """Whether the model is loaded and warmed up."""
+        return self._ready.is_set()
+
+    def load(self):
+        """Load the model (once) and return the tokenizer and model."""
+        with self._lock:
+            if self.model is None:
+                self._load()
+        return self.tokenizer, self.model
+
+    def load_in_background(self):
+        """
+        Start loading the model in a daemon thread, if not already started.
+
+        Never waits for the load itself, so readiness checks can call this and
+        answer straight away.
+        """
+        with self._thread_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._load_safely, name="model-loader", daemon=True
+                )
+                self._thread.start()
+        return self._thread
+
+    def wait_until_ready(self, timeout=None):
+        """Block until the model is ready. Returns False on timeout."""
+        return self._ready.wait(timeout)
+
+    def _load_safely(self):
+        try:
+            self.load()
+        except Exception as e:
+            self.error = e
+            print(f"Error loading model from {self.model_path}: {e}")
+
+    def _load(self):
+        start = time.perf_counter()
+        import torch
+        from transformers import AutoTokenizer, AutoModelForSeq2SeqLM
+
+        self.timings["import_seconds"] = time.perf_counter() - start
+
+        # Only force safetensors when the checkpoint has it, otherwise let
+        # transformers fall back to pytorch_model.bin
+        use_safetensors = None
+        if os.path.exists(os.path.join(self.model_path, "model.safetensors")):
+            use_safetensors = True
+
+        start = time.perf_counter()
+        tokenizer = AutoTokenizer.from_pretrained(self.model_path)
+        model = AutoModelForSeq2SeqLM.from_pretrained(
+            self.model_path,
+            use_safetensors=use_safetensors,
+            low_cpu_mem_usage=True,
+        )
+        model.eval()
+        self.timings["load_seconds"] = time.perf_counter() - start
+
+        self.tokenizer, self.model = tokenizer, model
+        self.warmup()
+        self._ready.set()
+
+    def warmup(self):
+        """Run `warmup_runs` generations on the loaded model."""
+        import torch
+
+        start = time.perf_counter()
+        if self.warmup_runs > 0:
+            inputs = self.tokenizer(self.warmup_text, return_tensors="pt")
+            with torch.no_grad():
+                for _ in range(self.warmup_runs):
+                    self.model.generate(inputs.input_ids, **self.warmup_kwargs)
+        self.timings["warmup_seconds"] = time.perf_counter() - start
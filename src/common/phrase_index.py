@@ -0,0 +1,151 @@
+"""
+Personal phrase index for instant completions of stock phrases.
+
+Counts, for every context of the last 1 to `max_context` words in the user's
+sent mail, which phrase of up to `max_words` words followed it. Lookups are a
+handful of dict accesses, so a confident match can be served without running
+the model. The index records which threads it has seen, so newly synced mail
+can be added without rebuilding it.
+
+Usage:
+    python phrase_index.py threads.json phrase_index.pkl
+"""
+
+import os
+import pickle
+import sys
+from collections import Counter, defaultdict
+
+from text_encoding import load_json_records
+
+# Punctuation that ends a phrase (matches split_into_sentences)
+SENTENCE_END = ".!?;:"
+
+
+def normalize_words(text):
+    """Split text into words, lower-cased for matching."""
+    return text.lower().split()
+
+
+class PhraseIndex:
+    """
+    N-gram table mapping recent words to counts of the phrases that followed.
+
+    Parameters:
+    - max_context: Longest context (in words) used for matching.
+    - max_words: Longest phrase (in words) suggested.
+    - min_count: Times a phrase must have been seen to be suggested.
+    - min_confidence: Share of continuations of the context the phrase must have.
+    """
+
+    def __init__(self, max_context=4, max_words=5, min_count=3, min_confidence=0.6):
+        self.max_context = max_context
+        self.max_words = max_words
+        self.min_count = min_count
+        self.min_confidence = min_confidence
+        self.table = defaultdict(Counter)
+        self.seen_threads = set()
+
+    def add_text(self, body):
+        """Add every (context, phrase) pair in an email body to the index."""
+        words = body.split()
+        keys = [word.lower() for word in words]
+        for i in range(1, len(words)):
+            phrase = []
+            for word in words[i : i + self.max_words]:
+                phrase.append(word)
+                if word[-1] in SENTENCE_END:
+                    break  # Do not suggest across sentence boundaries
+            phrase = " ".join(phrase)
+            for n in range(1, min(self.max_context, i) + 1):
+                self.table[tuple(keys[i - n : i])][phrase] += 1
+
+    def add_threads(self, threads):
+        """
+        Add threads not yet in the index.
+
+        Parameters:
+        - threads: List of {"thread_id", "body"} dicts, as in threads.json.
+
+        Returns:
+        - Number of threads added.
+        """
+        added = 0
+        for thread in threads:
+            thread_id = thread.get("thread_id")
+            if thread_id in self.seen_threads:
+                continue
+            self.add_text(thread.get("body", ""))
+            if thread_id is not None:
+                self.seen_threads.add(thread_id)
+            added += 1
+        return added
+
+    def lookup(self, text_so_far):
+        """
+        Suggest a phrase if the recent words confidently predict one.
+
+        The longest matching context wins; shorter contexts are only tried when
+        a longer one has not been seen. Text ending mid-word is not matched.
+
+        Returns:
+        - (phrase, confidence), or (None, 0.0) if there is no confident match.
+        """
+        if not text_so_far or not text_so_far[-1].isspace():
+            return None, 0.0
+        keys = normalize_words(text_so_far[-200:])[-self.max_context :]
+        for n in range(len(keys), 0, -1):
+            continuations = self.table.get(tuple(keys[-n:]))
+            if not continuations:
+                continue
+            phrase, count = continuations.most_common(1)[0]
+            confidence = count / sum(continuations.values())
+            if count >= self.min_count and confidence >= self.min_confidence:
+                return phrase, confidence
+            return None, 0.0
+        return None, 0.0
+
+    def save(self, path):
+        # Pickle the attributes rather than the instance, so the file loads
+        # the same whether this module ran as a script or was imported.
+        # Written to a temporary file and renamed into place, so a server
+        # reloading the index never reads a half-written file.
+        tmp_path = f"{path}.tmp{os.getpid()}"
+        try:
+            with open(tmp_path, "wb") as file:
+                pickle.dump(self.__dict__, file)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+    @staticmethod
+    def load(path):
+        index = PhraseIndex()
+        with open(path, "rb") as file:
+            index.__dict__.update(pickle.load(file))
+        return index
+
+
+def update_index_file(threads_file, index_path, **kwargs):
+    """
+    Add new threads from threads.json to a saved index, creating it if needed.
+
+    Returns:
+    - The updated PhraseIndex.
+    """
+    try:
+        index = PhraseIndex.load(index_path)
+    except FileNotFoundError:
+        index = PhraseIndex(**kwargs)
+
+    threads = load_json_records(threads_file)
+    added = index.add_threads(threads)
+    index.save(index_path)
+    print(f"Added {added} threads to phrase index {index_path}")
+    return index
+
+
+if __name__ == "__main__":
+    update_index_file(sys.argv[1], sys.argv[2])
@@ -0,0 +1,200 @@
+"""
+Encoding detection and repair for the email ingestion pipeline.
+
+Replaces running chardet over a whole dataset and fixing it by hand with
+iconv. The encoding is detected from a bounded sample at the start of the
+file and the rest is decoded in chunks. Bytes that are invalid in that
+encoding are kept as surrogate escapes instead of being dropped, so each
+record can be repaired on its own, or flagged if it cannot be repaired.
+
+Usage:
+    python text_encoding.py fine_tune_dataset.json fine_tune_dataset_fixed.json
+"""
+
+import codecs
+import io
+import json
+import re
+import sys
+
+# Bytes read from the start of a file to detect its encoding
+SAMPLE_BYTES = 64 * 1024
+# Bytes decoded at a time when transcoding
+CHUNK_BYTES = 1024 * 1024
+# Used for bytes that are not valid in the detected encoding
+FALLBACK_ENCODING = "cp1252"
+# Encodings that UTF-8 text is commonly mis-decoded as (mojibake such as "â€™")
+MOJIBAKE_ENCODINGS = ("cp1252", "mac_roman")
+
+BOMS = [
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF32_LE, "utf-32"),
+    (codecs.BOM_UTF32_BE, "utf-32"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+]
+
+BAD_BYTES = re.compile("[\udc80-\udcff]+")
+NON_ASCII = re.compile("[^\x00-\x7f]")
+
+
+def detect_encoding(sample):
+    """
+    Detect the encoding of the start of a file.
+
+    Parameters:
+    - sample: Bytes from the start of the file, SAMPLE_BYTES is enough.
+
+    Returns:
+    - A Python codec name.
+    """
+    for bom, encoding in BOMS:
+        if sample.startswith(bom):
+            return encoding
+
+    # UTF-8 is by far the most common case, and a cut-off character at the end
+    # of the sample is not an error. A few invalid bytes among valid multi-byte
+    # characters are bad records in a UTF-8 file, not a different encoding.
+    decoder = codecs.getincrementaldecoder("utf-8")("surrogateescape")
+    text = decoder.decode(sample, final=False)
+    bad = sum(len(run) for run in BAD_BYTES.findall(text))
+    if bad <= len(NON_ASCII.findall(text)) - bad:
+        return "utf-8"
+
+    # Only needed for files that are not UTF-8
+    from charset_normalizer import from_bytes
+
+    match = from_bytes(sample).best()
+    return match.encoding if match else FALLBACK_ENCODING
+
+
+def open_text(path, encoding=None):
+    """
+    Open a file for streaming reads in its detected encoding.
+
+    Invalid bytes are decoded as surrogate escapes for repair_text to fix.
+
+    Returns:
+    - (text file, encoding)
+    """
+    raw = open(path, "rb")
+    if encoding is None:
+        encoding = detect_encoding(raw.read(SAMPLE_BYTES))
+        raw.seek(0)
+    text = io.TextIOWrapper(raw, encoding=encoding, errors="surrogateescape")
+    return text, encoding
+
+
+def repair_bad_bytes(text, fallback=FALLBACK_ENCODING):
+    """Decode surrogate-escaped bytes in text with the fallback encoding."""
+    return BAD_BYTES.sub(
+        lambda match: match.group()
+        .encode("utf-8", "surrogateescape")
+        .decode(fallback, errors="replace"),
+        text,
+    )
+
+
+def repair_mojibake(text):
+    """Undo UTF-8 that was decoded as a single-byte encoding, if it was."""
+    if not NON_ASCII.search(text):
+        return text
+    for encoding in MOJIBAKE_ENCODINGS:
+        try:
+            # Only succeeds if every non-ASCII character maps back to valid UTF-8
+            return text.encode(encoding).decode("utf-8")
+        except UnicodeError:
+            continue
+    return text
+
+
+def repair_text(text):
+    """
+    Repair one field of a record.
+
+    Returns:
+    - (text, status), where status is None if the text was fine, "repaired" if
+      it was changed, or "bad" if it still contains undecodable characters.
+    """
+    repaired = repair_mojibake(repair_bad_bytes(text))
+    if "\ufffd" in repaired and "\ufffd" not in text:
+        return repaired, "bad"
+    return repaired, "repaired" if repaired != text else None
+
+
+def decode_bytes(data, declared=None):
+    """
+    Decode a byte string such as a MIME part, using its declared charset if
+    that is a known codec and detecting the encoding otherwise.
+
+    Returns:
+    - (text, status) as for repair_text.
+    """
+    encoding = None
+    if declared:
+        try:
+            encoding = codecs.lookup(declared).name
+        except LookupError:
+            pass
+    if encoding is None:
+        encoding = detect_encoding(data[:SAMPLE_BYTES])
+    return repair_text(data.decode(encoding, errors="surrogateescape"))
+
+
+def load_json_records(path, fields=("subject", "body")):
+    """
+    Load a JSON list of records, repairing the encoding of their text fields.
+
+    Records whose fields cannot be repaired are left out and reported.
+
+    Parameters:
+    - path: JSON file in any encoding.
+    - fields: Text fields of each record to check.
+
+    Returns:
+    - The list of clean records.
+    """
+    file, encoding = open_text(path)
+    with file:
+        records = json.load(file)
+
+    clean, repaired, bad = [], 0, 0
+    for record in records:
+        statuses = set()
+        for field in fields:
+            if isinstance(record.get(field), str):
+                record[field], status = repair_text(record[field])
+                statuses.add(status)
+        if "bad" in statuses:
+            bad += 1
+            continue
+        repaired += "repaired" in statuses
+        clean.append(record)
+
+    print(
+        f"Read {path} as {encoding}: {len(records)} records, "
+        f"{repaired} repaired, {bad} skipped as unreadable"
+    )
+    return clean
+
+
+def transcode_file(input_path, output_path, encoding=None):
+    """
+    Rewrite a file as UTF-8 in chunks, repairing invalid bytes on the way.
+
+    Returns:
+    - The detected source encoding.
+    """
+    source, encoding = open_text(input_path, encoding)
+    with source, open(output_path, "w", encoding="utf-8") as output:
+        while True:
+            chunk = source.read(CHUNK_BYTES)
+            if not chunk:
+                break
+            output.write(repair_bad_bytes(chunk))
+    print(f"Transcoded {input_path} from {encoding} to UTF-8 in {output_path}")
+    return encoding
+
+
+if __name__ == "__main__":
+    transcode_file(sys.argv[1], sys.argv[2])
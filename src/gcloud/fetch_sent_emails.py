@@ -5,8 +5,16 @@ from google.auth.transport.requests import Request
 import pickle
 import os
 import re
+import sys
 from tqdm import tqdm
 
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.abspath(os.path.join(SCRIPT_DIR, "../../"))
+
+sys.path.append(os.path.join(PROJECT_ROOT, "src/common"))
+from phrase_index import update_index_file
+from text_encoding import decode_bytes
+
 SCOPES = ["https://www.googleapis.com/auth/gmail.readonly"]
 
 
@@ -16,15 +24,25 @@ def extract_email_body(payload):
         for part in payload["parts"]:
             if part["mimeType"] == "text/plain" and "body" in part:
                 data = part["body"].get("data", "")
-                return decode_base64(data)
+                return decode_base64(data, part_charset(part))
             elif "parts" in part:
                 return extract_email_body(part)  # Recursively handle nested parts
     elif "body" in payload:
         data = payload["body"].get("data", "")
-        return decode_base64(data)
+        return decode_base64(data, part_charset(payload))
     return ""
 
 
+def part_charset(part):
+    """The charset declared in a MIME part's Content-Type header, if any."""
+    for header in part.get("headers", []):
+        if header["name"].lower() == "content-type":
+            match = re.search(r'charset="?([^";\s]+)', header["value"], re.I)
+            if match:
+                return match.group(1)
+    return None
+
+
 def clean_email_body(body):
     """
     Remove quoted replies, forwarded content, and metadata from an email body.
@@ -86,11 +104,13 @@ def clean_email_body(body):
     return "\n".join(cleaned_lines)
 
 
-def decode_base64(data):
-    """Decode base64-encoded email content."""
+def decode_base64(data, charset=None):
+    """Decode base64-encoded email content in its declared or detected charset."""
     import base64
 
-    return base64.urlsafe_b64decode(data).decode("utf-8", errors="ignore")
+    text, status = decode_bytes(base64.urlsafe_b64decode(data), charset)
+    # Unreadable bodies come back empty, so the email is skipped
+    return "" if status == "bad" else text
 
 
 from tqdm import tqdm
@@ -219,6 +239,9 @@ def main():
     service = build("gmail", "v1", credentials=creds)
     fetch_initial_emails(service, "threads.json")
 
+    # Add newly synced threads to the phrase index used by the model server
+    update_index_file("threads.json", "phrase_index.pkl")
+
 
 if __name__ == "__main__":
     main()
@@ -1,7 +1,16 @@
 import json
+import os
 import re
+import sys
 from tqdm import tqdm
 
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.abspath(os.path.join(SCRIPT_DIR, "../../"))
+
+sys.path.append(os.path.join(PROJECT_ROOT, "src/common"))
+from context_window import build_input_text
+from text_encoding import load_json_records
+
 
 def clean_text(text):
     """Clean and sanitize email text."""
@@ -112,8 +121,8 @@ def create_incremental_entries(subject, body, max_words=5):
         ):
             continue
 
-        # Format input with structured tags
-        input_text = f"[SUBJECT] {subject}\n[TEXT SO FAR] {text_so_far}".strip()
+        # Format input with structured tags, windowed the same way as at serving time
+        input_text = build_input_text(subject, text_so_far)
         entries.append({"input": input_text, "output": next_words})
 
         # Update text_so_far with the next token
@@ -132,8 +141,8 @@ def format_emails_for_finetuning(input_file, output_file, min_tokens=25, max_wor
     - min_tokens: Minimum number of tokens required in the email body.
     - max_words: Maximum number of words to include in each output.
     """
-    with open(input_file, "r", encoding="utf-8") as file:
-        threads = json.load(file)
+    # Detects the file's encoding and repairs or skips mis-encoded threads
+    threads = load_json_records(input_file)
 
     formatted_data = []
     for thread in tqdm(threads, desc="Formatting Emails"):
@@ -1,7 +1,16 @@
 import json
+import os
 import re
+import sys
 from tqdm import tqdm
 
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.abspath(os.path.join(SCRIPT_DIR, "../../"))
+
+sys.path.append(os.path.join(PROJECT_ROOT, "src/common"))
+from context_window import build_input_text
+from text_encoding import load_json_records
+
 
 def clean_text(text):
     """Clean and sanitize email text."""
@@ -137,7 +146,7 @@ def create_sentence_completion_entries(subject, body):
             text_so_far = " ".join(tokens[:i])
             completion = " ".join(tokens[i:])
             if text_so_far and completion:
-                input_text = f"[SUBJECT] {subject}\n[TEXT SO FAR] {text_so_far}"
+                input_text = build_input_text(subject, text_so_far)
                 entries.append({"input": input_text, "output": completion})
 
     return entries
@@ -152,8 +161,8 @@ def format_emails_for_sentence_completion(input_file, output_file, min_tokens=25
     - output_file: Path to save the formatted dataset.
     - min_tokens: Minimum number of tokens required in the email body.
     """
-    with open(input_file, "r", encoding="utf-8") as file:
-        threads = json.load(file)
+    # Detects the file's encoding and repairs or skips mis-encoded threads
+    threads = load_json_records(input_file)
 
     formatted_data = []
     for thread in tqdm(threads, desc="Formatting Emails"):
@@ -1,11 +1,10 @@
+import json
 import keyboard
 import os
 import readchar
+import socket
 import sys
-import time
 import threading
-import torch
-from transformers import AutoTokenizer, AutoModelForSeq2SeqLM
 
 # Disable parallelism to avoid warnings
 os.environ["TOKENIZERS_PARALLELISM"] = "false"
@@ -13,22 +12,116 @@ os.environ["TOKENIZERS_PARALLELISM"] = "false"
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 PROJECT_ROOT = os.path.abspath(os.path.join(SCRIPT_DIR, "../../"))
 
-MODEL_PATH = os.path.join(PROJECT_ROOT, "src/transformers/fine_tuned_model")
+# Same checkpoint as the model server, so suggestions do not depend on whether
+# a server is running
+MODEL_PATH = os.path.join(
+    PROJECT_ROOT, "src/transformers/fine_tuned_model_email_writer"
+)
 
-# Load the model and tokenizer
-print("Loading the fine-tuned model and tokenizer...")
-tokenizer = AutoTokenizer.from_pretrained(MODEL_PATH)
-model = AutoModelForSeq2SeqLM.from_pretrained(MODEL_PATH)
+sys.path.append(os.path.join(PROJECT_ROOT, "src/common"))
+from context_window import build_input_text, window_text_so_far
+from local_socket import default_socket_path, is_own_socket
+from model_loader import ModelLoader
 
+# Unix socket of a running model server (see model_server/app.py). When one is
+# up the demo is a thin client of it instead of loading its own model.
+try:
+    SERVER_SOCKET = default_socket_path()
+except PermissionError as e:
+    print(f"Not using a model server: {e}")
+    SERVER_SOCKET = ""
+
+# Without a server, the model is loaded in the background while the user types
+# the subject
+loader = ModelLoader(MODEL_PATH)
+server_client = None
+
+# Pause in typing before a suggestion is generated
+DEBOUNCE_SECONDS = 0.3
+
+# State shared by the typing loop and the suggestion worker, guarded by
+# user_input_changed
+user_input_changed = threading.Condition()
+user_input = ""
+input_version = 0  # Incremented whenever user_input changes
+show_suggestion = False
 autocomplete_suggestion = ""
+suggestion_version = -1  # input_version the suggestion was generated for
 stop_autocomplete = False
-user_input_lock = threading.Lock()
-user_input = ""
+
+# Serializes terminal output from both threads
+display_lock = threading.Lock()
+
+
+class ServerClient:
+    """Persistent Unix socket connection to a running model server."""
+
+    def __init__(self, socket_path, timeout=30):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.file = None
+
+    def _connect(self):
+        if not is_own_socket(self.socket_path):
+            # Never send what the user types to someone else's server
+            raise PermissionError(f"{self.socket_path} is not our own socket")
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.socket_path)
+        self.file = sock.makefile("rwb")
+        sock.close()  # The file keeps its own reference to the socket
+
+    def _request(self, payload):
+        if self.file is None:
+            self._connect()
+        self.file.write(json.dumps(payload).encode("utf-8") + b"\n")
+        self.file.flush()
+        line = self.file.readline()
+        if not line:
+            raise ConnectionError("Model server closed the connection")
+        return json.loads(line)
+
+    def complete(self, subject, text_so_far):
+        """Suggestion from the server. Raises OSError if it is not running."""
+        # Only the window the model sees is sent, so requests stay small
+        payload = {"subject": subject, "text_so_far": window_text_so_far(text_so_far)}
+        if text_so_far[-1:].isspace():
+            payload["text_so_far"] += " "  # Keep the completed-word marker
+        try:
+            response = self._request(payload)
+        except OSError:
+            # Reconnect once, e.g. after the server restarted
+            self.file = None
+            response = self._request(payload)
+        # No suggestion on errors such as the server still loading its model
+        return response.get("suggestion", "").strip()
+
+    @classmethod
+    def connect(cls, socket_path):
+        """Client for the server on `socket_path`, or None if none is running."""
+        client = cls(socket_path)
+        try:
+            client._connect()
+        except OSError:
+            return None
+        return client
 
 
 def generate_completion(subject, text_so_far):
     """Generate auto-completion."""
-    input_text = f"[SUBJECT] {subject}\n[TEXT SO FAR] {text_so_far.strip()}"
+    global server_client
+    if server_client is not None:
+        try:
+            return server_client.complete(subject, text_so_far)
+        except OSError:
+            # Server went away, fall back to a local model
+            server_client = None
+            loader.load_in_background()
+
+    import torch
+
+    tokenizer, model = loader.load()
+    input_text = build_input_text(subject, text_so_far)
     inputs = tokenizer(input_text, return_tensors="pt")
     with torch.no_grad():
         output_ids = model.generate(
@@ -41,19 +134,81 @@ def generate_completion(subject, text_so_far):
     return suggestion.strip()
 
 
+def update_user_input(text, show=False):
+    """Publish the current input to the suggestion worker."""
+    global user_input, input_version, show_suggestion
+    with user_input_changed:
+        if text != user_input:
+            user_input = text
+            input_version += 1
+            user_input_changed.notify()
+        show_suggestion = show
+
+
+def current_suggestion():
+    """The suggestion to display, if it is for the current input."""
+    with user_input_changed:
+        if show_suggestion and suggestion_version == input_version:
+            return autocomplete_suggestion
+    return ""
+
+
+def render():
+    """Redraw the current line with the inline suggestion, if any."""
+    with user_input_changed:
+        text = user_input
+    suggestion = current_suggestion()
+    with display_lock:
+        print("\r\033[K", end="")  # Clear the current line
+        if suggestion:
+            print(f"{text} [SUGGESTION] {suggestion}", end="", flush=True)
+        else:
+            print(text, end="", flush=True)
+
+
 def suggest_autocomplete(subject):
-    """Thread to generate suggestions."""
-    global autocomplete_suggestion, stop_autocomplete
-    while not stop_autocomplete:
-        time.sleep(1)  # Check every second for updates
-        with user_input_lock:
-            if user_input.strip():
-                autocomplete_suggestion = generate_completion(subject, user_input)
+    """
+    Thread to generate suggestions.
+
+    Sleeps until the input changes and typing pauses for DEBOUNCE_SECONDS, then
+    generates for a snapshot of the input without holding the lock, so
+    keystrokes are never blocked by the model. Unchanged input is not
+    regenerated and results for input that changed meanwhile are dropped.
+    """
+    global autocomplete_suggestion, suggestion_version
+    seen_version = 0
+    last_text, last_suggestion = None, ""
+    while True:
+        with user_input_changed:
+            # Wait for new input, then for typing to pause
+            while not stop_autocomplete and input_version == seen_version:
+                user_input_changed.wait()
+            while not stop_autocomplete:
+                seen_version = input_version
+                user_input_changed.wait(DEBOUNCE_SECONDS)
+                if input_version == seen_version:
+                    break
+            if stop_autocomplete:
+                return
+            text = user_input
+
+        # Suggestions are only shown after a completed word
+        if not text.strip() or not text.endswith(" "):
+            continue
+        if text != last_text:
+            last_text, last_suggestion = text, generate_completion(subject, text)
+
+        with user_input_changed:
+            if input_version != seen_version:
+                continue  # Input changed during generation, drop the result
+            autocomplete_suggestion = last_suggestion
+            suggestion_version = seen_version
+        render()
 
 
 def real_time_input(subject):
     """Capture user input and display auto-completions."""
-    global user_input, autocomplete_suggestion, stop_autocomplete
+    global stop_autocomplete
 
     print("\n--- Email Auto-Complete Assistant ---\n")
     print("Start typing your email body. Press [Tab] to accept suggestions.")
@@ -61,7 +216,6 @@ def real_time_input(subject):
 
     email_body = ""
     buffer = []
-    show_suggestion = False
 
     try:
         # Start the auto-complete suggestion thread
@@ -78,51 +232,38 @@ def real_time_input(subject):
                 buffer.append(" ")  # Add space to buffer
                 email_body += "".join(buffer)  # Append buffer to email body
                 buffer = []  # Clear the buffer
-                with user_input_lock:
-                    user_input = (
-                        email_body  # Update user_input to include the final word
-                    )
-                show_suggestion = True  # Trigger suggestion
+                update_user_input(email_body, show=True)  # Trigger suggestion
             elif char == readchar.key.BACKSPACE:
                 if buffer:
                     buffer.pop()  # Remove last character in buffer
                 elif email_body:
                     email_body = email_body[:-1]  # Remove last character in body
-                show_suggestion = False  # Clear suggestion on new input
+                # Clear suggestion on new input
+                update_user_input(email_body + "".join(buffer))
             elif char == "\t":  # Tab to accept suggestion
-                if autocomplete_suggestion and show_suggestion:
-                    email_body += f"{autocomplete_suggestion.strip()} "
+                suggestion = current_suggestion()
+                if suggestion:
+                    email_body += f"{suggestion.strip()} "
                     buffer = []  # Clear buffer after accepting suggestion
-                    with user_input_lock:
-                        user_input = email_body  # Update user_input after accepting
-                    show_suggestion = False  # Suggestion accepted
+                    update_user_input(email_body)  # Suggestion accepted
             elif char == readchar.key.ENTER:  # Enter to finish
                 print("\nExiting...")
                 break
             else:
                 # Append regular characters to the buffer
                 buffer.append(char)
-                with user_input_lock:
-                    user_input = email_body + "".join(
-                        buffer
-                    )  # Update user_input in real-time
-                show_suggestion = False  # Clear suggestion when user types
+                # Clear suggestion when user types
+                update_user_input(email_body + "".join(buffer))
 
             # Display inline suggestion or just the current text
-            print("\r\033[K", end="")  # Clear the current line
-            if show_suggestion and autocomplete_suggestion:
-                print(
-                    f"{email_body}{''.join(buffer)} [SUGGESTION] {autocomplete_suggestion}",
-                    end="",
-                    flush=True,
-                )
-            else:
-                print(f"{email_body}{''.join(buffer)}", end="", flush=True)
+            render()
 
     except KeyboardInterrupt:
         print("\nExiting the email assistant.")
     finally:
-        stop_autocomplete = True
+        with user_input_changed:
+            stop_autocomplete = True
+            user_input_changed.notify_all()
         autocomplete_thread.join()
 
     print("\nFinal Email Body:\n", email_body.strip())
@@ -130,5 +271,12 @@ def real_time_input(subject):
 
 
 if __name__ == "__main__":
+    if SERVER_SOCKET:
+        server_client = ServerClient.connect(SERVER_SOCKET)
+    if server_client is not None:
+        print(f"Using the model server on {SERVER_SOCKET}")
+    else:
+        print("Loading the fine-tuned model and tokenizer...")
+        loader.load_in_background()
     subject = input("Enter the subject of your email: ").strip()
     real_time_input(subject)
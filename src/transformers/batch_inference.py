@@ -0,0 +1,217 @@
+"""
+Batched offline inference over a file of prompts.
+
+Streams prompts from a JSONL file (or a JSON list such as the formatted
+fine-tuning dataset), sorts each chunk by length so batches need little
+padding, and generates with a named decoding profile across worker
+processes. Predictions and their scores are appended to a JSONL file as each
+batch finishes, and prompts already in the output file are skipped, so an
+interrupted run picks up where it stopped.
+
+Usage:
+    python batch_inference.py ../gcloud/fine_tune_dataset.json predictions.jsonl \\
+        --profile greedy --workers 4 --batch-size 16
+"""
+
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+from tqdm import tqdm
+
+# Disable parallelism to avoid issues if running on local machine
+os.environ["TOKENIZERS_PARALLELISM"] = "false"
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.abspath(os.path.join(SCRIPT_DIR, "../../"))
+MODEL_PATH = os.path.join(PROJECT_ROOT, "src/transformers/fine_tuned_model")
+
+sys.path.append(os.path.join(PROJECT_ROOT, "src/common"))
+from decoding_profiles import DECODING_PROFILES, get_profile
+from model_loader import ModelLoader
+
+# Set in the parent before forking so workers share the weights copy-on-write
+loader = None
+generate_kwargs = None
+
+
+def read_records(input_file, input_field):
+    """
+    Yield (record id, record) pairs from a JSONL file or a JSON list.
+
+    JSONL is streamed line by line; a JSON list has to be loaded whole. The
+    record id is its position in the file unless the record has an "id".
+    """
+    with open(input_file, "r", encoding="utf-8") as file:
+        if input_file.endswith(".jsonl"):
+            records = (json.loads(line) for line in file if line.strip())
+        else:
+            records = iter(json.load(file))
+        for i, record in enumerate(records):
+            if isinstance(record, str):
+                record = {input_field: record}
+            yield record.get("id", i), record
+
+
+def read_done_ids(output_file):
+    """Ids already written to the output file by an earlier run."""
+    done = set()
+    if not os.path.exists(output_file):
+        return done
+    with open(output_file, "r", encoding="utf-8") as file:
+        for line in file:
+            try:
+                done.add(json.loads(line)["id"])
+            except (json.JSONDecodeError, KeyError):
+                continue
+    return done
+
+
+def drop_partial_line(output_file):
+    """Remove a partially written last line left by an interrupted run."""
+    if not os.path.exists(output_file):
+        return
+    with open(output_file, "rb+") as file:
+        data = file.read()
+        if data and not data.endswith(b"\n"):
+            file.truncate(data.rfind(b"\n") + 1)
+
+
+def make_batches(records, input_field, chunk_size, batch_size):
+    """Sort each chunk of records by prompt length and split it into batches."""
+    while True:
+        chunk = list(itertools.islice(records, chunk_size))
+        if not chunk:
+            return
+        chunk.sort(key=lambda item: len(item[1][input_field]))
+        for i in range(0, len(chunk), batch_size):
+            yield chunk[i : i + batch_size]
+
+
+def init_worker(threads):
+    import torch
+
+    torch.set_num_threads(threads)
+
+
+def run_batch(batch, input_field="input"):
+    """Generate predictions and scores for one batch of (id, record) pairs."""
+    import torch
+
+    tokenizer, model = loader.tokenizer, loader.model
+    prompts = [record[input_field] for _, record in batch]
+    inputs = tokenizer(
+        prompts, return_tensors="pt", padding=True, truncation=True, max_length=512
+    )
+    with torch.no_grad():
+        outputs = model.generate(
+            input_ids=inputs.input_ids,
+            attention_mask=inputs.attention_mask,
+            output_scores=True,
+            return_dict_in_generate=True,
+            **generate_kwargs,
+        )
+
+    if generate_kwargs.get("num_beams", 1) > 1:
+        # Length-normalized log probability of each beam
+        scores = outputs.sequences_scores.tolist()
+    else:
+        # Mean log probability of the generated tokens
+        transition_scores = model.compute_transition_scores(
+            outputs.sequences, outputs.scores, normalize_logits=True
+        )
+        generated = outputs.sequences[:, 1:] != tokenizer.pad_token_id
+        scores = (
+            (transition_scores * generated).sum(dim=1) / generated.sum(dim=1).clamp(1)
+        ).tolist()
+
+    predictions = tokenizer.batch_decode(outputs.sequences, skip_special_tokens=True)
+    results = []
+    for (record_id, record), prediction, score in zip(batch, predictions, scores):
+        result = {"id": record_id, "input": record[input_field]}
+        if "output" in record:
+            result["reference"] = record["output"]
+        result.update(prediction=prediction, score=score)
+        results.append(result)
+    return results
+
+
+def run_batch_with_field(item):
+    """run_batch for Pool.imap, which passes a single argument."""
+    batch, input_field = item
+    return run_batch(batch, input_field)
+
+
+def main():
+    global loader, generate_kwargs
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("input_file", help="JSONL or JSON list of prompts")
+    parser.add_argument("output_file", help="JSONL file of predictions")
+    parser.add_argument("--model-path", default=MODEL_PATH)
+    parser.add_argument("--profile", default="greedy", choices=DECODING_PROFILES)
+    parser.add_argument("--input-field", default="input")
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument(
+        "--chunk-size", type=int, default=1024, help="Prompts sorted together"
+    )
+    parser.add_argument("--workers", type=int, default=1)
+    args = parser.parse_args()
+
+    generate_kwargs = get_profile(args.profile)
+    drop_partial_line(args.output_file)
+    done = read_done_ids(args.output_file)
+    if done:
+        print(f"Resuming, skipping {len(done)} prompts already in {args.output_file}")
+    records = (
+        (record_id, record)
+        for record_id, record in read_records(args.input_file, args.input_field)
+        if record_id not in done
+    )
+    batches = make_batches(records, args.input_field, args.chunk_size, args.batch_size)
+
+    print(f"Loading model from {args.model_path}...")
+    loader = ModelLoader(args.model_path, warmup_runs=0)
+    loader.load()
+
+    threads = max(1, (os.cpu_count() or 1) // args.workers)
+    start = time.perf_counter()
+    written = 0
+    with open(args.output_file, "a", encoding="utf-8") as output, tqdm(
+        desc="Generating", unit="prompt"
+    ) as pbar:
+        if args.workers > 1:
+            pool = multiprocessing.get_context("fork").Pool(
+                args.workers, initializer=init_worker, initargs=(threads,)
+            )
+            results_iter = pool.imap_unordered(
+                run_batch_with_field, ((batch, args.input_field) for batch in batches)
+            )
+        else:
+            init_worker(threads)
+            results_iter = (run_batch(batch, args.input_field) for batch in batches)
+
+        for results in results_iter:
+            for result in results:
+                output.write(json.dumps(result, ensure_ascii=False) + "\n")
+            output.flush()  # Everything written so far survives an interruption
+            written += len(results)
+            pbar.update(len(results))
+
+        if args.workers > 1:
+            pool.close()
+            pool.join()
+
+    elapsed = time.perf_counter() - start
+    print(
+        f"Wrote {written} predictions to {args.output_file} "
+        f"({written / elapsed:.1f} prompts/s)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,5 @@
 import os
-
-from transformers import AutoTokenizer, AutoModelForSeq2SeqLM
+import sys
 
 # Disable parallelism to avoid issues if running on local machine
 os.environ["TOKENIZERS_PARALLELISM"] = "false"
@@ -10,10 +9,12 @@ SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 PROJECT_ROOT = os.path.abspath(os.path.join(SCRIPT_DIR, "../../"))
 MODEL_PATH = os.path.join(PROJECT_ROOT, "src/transformers/fine_tuned_model")
 
-# Load the fine-tuned model and tokenizer
+sys.path.append(os.path.join(PROJECT_ROOT, "src/common"))
+from model_loader import ModelLoader
+
+# Load the fine-tuned model and tokenizer (no warmup needed for a single run)
 print("Loading the fine-tuned model and tokenizer...")
-tokenizer = AutoTokenizer.from_pretrained(MODEL_PATH)
-model = AutoModelForSeq2SeqLM.from_pretrained(MODEL_PATH)
+tokenizer, model = ModelLoader(MODEL_PATH, warmup_runs=0).load()
 
 # Test input
 input_text = (
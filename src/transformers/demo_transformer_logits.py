@@ -1,9 +1,5 @@
-import torch
 import os
-from transformers import AutoTokenizer, AutoModelForSeq2SeqLM
-import matplotlib.pyplot as plt
-import seaborn as sns
-import pandas as pd
+import sys
 
 # Disable parallelism to avoid issues if running on local machine
 os.environ["TOKENIZERS_PARALLELISM"] = "false"
@@ -13,10 +9,14 @@ SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 PROJECT_ROOT = os.path.abspath(os.path.join(SCRIPT_DIR, "../../"))
 MODEL_PATH = os.path.join(PROJECT_ROOT, "src/transformers/fine_tuned_model")
 
-# Load the fine-tuned model and tokenizer
+sys.path.append(os.path.join(PROJECT_ROOT, "src/common"))
+from model_loader import ModelLoader
+
+# Load the fine-tuned model and tokenizer (no warmup needed for a single run)
 print("Loading the fine-tuned model and tokenizer...")
-tokenizer = AutoTokenizer.from_pretrained(MODEL_PATH)
-model = AutoModelForSeq2SeqLM.from_pretrained(MODEL_PATH)
+tokenizer, model = ModelLoader(MODEL_PATH, warmup_runs=0).load()
+
+import torch  # Cheap here, the loader has already imported it
 
 # Test input
 input_text = "[SUBJECT] Question About My iPhone\n[TEXT SO FAR] How "
@@ -45,6 +45,11 @@ unnormalized_likelihoods = torch.exp(
     beam_scores
 ).tolist()  # Convert log probabilities to unnormalized likelihoods
 
+# Plotting libraries are only needed from here on
+import matplotlib.pyplot as plt
+import seaborn as sns
+import pandas as pd
+
 # Create a DataFrame for Seaborn visualization
 data = pd.DataFrame(
     {"Inference": sequences, "Unnormalized Likelihood": unnormalized_likelihoods}
@@ -0,0 +1,293 @@
+"""
+Quality-vs-latency evaluation of decoding and model configurations.
+
+Replays held-out emails from threads.json as typing sessions: after every
+typed word the configuration suggests a completion, which is compared with
+the words the user actually typed next. For every combination of model,
+backend, num_beams and max_length this records per-request latency and
+
+- accepted prefix: leading suggestion words matching what was typed next
+- exact match: the whole suggestion matches what was typed next
+- keystrokes saved: characters per suggestion the user would not have typed
+  by pressing Tab on exact matches (less one keystroke for the Tab)
+
+and prints a table marking the Pareto-optimal configurations (no other
+configuration is both faster at p95 and saves more keystrokes). With
+--output the per-request latencies are saved too.
+
+Backends:
+- generate: model.generate with the given num_beams and max_length
+- speculative: greedy decoding with the sent-mail n-gram draft
+- phrase_index: the phrase index fast path, falling back to generate
+
+The draft and phrase index are built from the emails not held out. For a fair
+quality comparison the models should not have been fine-tuned on the
+held-out emails.
+
+Usage:
+    python evaluate_decoding.py ../gcloud/threads.json \\
+        --models fine_tuned_model fine_tuned_model_bart \\
+        --num-beams 1 5 --max-lengths 20 50 --backends generate speculative
+"""
+
+import argparse
+import csv
+import itertools
+import json
+import os
+import statistics
+import sys
+import time
+
+from tqdm import tqdm
+
+from fine_tune_transformer import load_data
+
+# Disable parallelism to avoid issues if running on local machine
+os.environ["TOKENIZERS_PARALLELISM"] = "false"
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.abspath(os.path.join(SCRIPT_DIR, "../../"))
+
+sys.path.append(os.path.join(PROJECT_ROOT, "src/common"))
+from context_window import build_input_text
+from model_loader import ModelLoader
+from phrase_index import PhraseIndex
+from speculative_decoding import TokenNgramDraft, speculative_generate
+
+BACKENDS = ("generate", "speculative", "phrase_index")
+
+
+def typing_positions(body, max_positions):
+    """
+    Word boundaries at which a suggestion is requested, evenly spread.
+
+    Returns:
+    - List of (text typed so far, words typed next).
+    """
+    words = body.split()
+    positions = list(range(1, len(words)))
+    if max_positions and len(positions) > max_positions:
+        step = len(positions) / max_positions
+        positions = [positions[int(i * step)] for i in range(max_positions)]
+    return [(" ".join(words[:i]) + " ", words[i:]) for i in positions]
+
+
+def score_suggestion(suggestion, next_words):
+    """Accepted prefix length, exact match and keystrokes saved for a suggestion."""
+    suggested = suggestion.split()
+    accepted = 0
+    for suggested_word, next_word in zip(suggested, next_words):
+        if suggested_word != next_word:
+            break
+        accepted += 1
+    exact = bool(suggested) and accepted == len(suggested)
+    saved = len(" ".join(suggested)) - 1 if exact else 0
+    return accepted, exact, saved
+
+
+def make_suggest_fn(backend, tokenizer, model, num_beams, max_length, draft, index):
+    """Function mapping (subject, text so far) to a suggestion for a configuration."""
+    import torch
+
+    def generate(subject, text_so_far):
+        inputs = tokenizer(build_input_text(subject, text_so_far), return_tensors="pt")
+        if backend == "speculative":
+            output_ids, _ = speculative_generate(
+                model, inputs.input_ids, draft, max_length=max_length
+            )
+        else:
+            with torch.no_grad():
+                output_ids = model.generate(
+                    input_ids=inputs.input_ids,
+                    max_length=max_length,
+                    num_beams=num_beams,
+                    early_stopping=num_beams > 1,
+                )
+        return tokenizer.decode(output_ids[0], skip_special_tokens=True).strip()
+
+    def phrase_index_or_generate(subject, text_so_far):
+        phrase, _ = index.lookup(text_so_far)
+        return phrase if phrase is not None else generate(subject, text_so_far)
+
+    if backend == "phrase_index":
+        return phrase_index_or_generate
+    return generate
+
+
+def evaluate(suggest_fn, sessions):
+    """
+    Replay typing sessions through a suggestion function and collect metrics.
+
+    Every session must have at least one typing position.
+    """
+    latencies, accepted, exact, saved = [], [], [], []
+    for subject, positions in sessions:
+        for text_so_far, next_words in positions:
+            start = time.perf_counter()
+            suggestion = suggest_fn(subject, text_so_far)
+            latencies.append(time.perf_counter() - start)
+            prefix, is_exact, keystrokes = score_suggestion(suggestion, next_words)
+            accepted.append(prefix)
+            exact.append(is_exact)
+            saved.append(keystrokes)
+
+    ordered = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "latency_p50_ms": ordered[len(ordered) // 2] * 1000,
+        "latency_p95_ms": ordered[int(len(ordered) * 0.95)] * 1000,
+        "latency_mean_ms": statistics.mean(latencies) * 1000,
+        "accepted_prefix": statistics.mean(accepted),
+        "exact_match": statistics.mean(exact),
+        "keystrokes_saved": statistics.mean(saved),
+        # In request order, for plotting distributions or other percentiles
+        "latencies_ms": [latency * 1000 for latency in latencies],
+    }
+
+
+def mark_pareto(rows):
+    """Flag rows not beaten on both p95 latency and keystrokes saved."""
+    for row in rows:
+        row["pareto"] = not any(
+            other["latency_p95_ms"] <= row["latency_p95_ms"]
+            and other["keystrokes_saved"] >= row["keystrokes_saved"]
+            and (
+                other["latency_p95_ms"] < row["latency_p95_ms"]
+                or other["keystrokes_saved"] > row["keystrokes_saved"]
+            )
+            for other in rows
+        )
+
+
+def print_table(rows):
+    columns = [
+        ("model", "{}"),
+        ("backend", "{}"),
+        ("num_beams", "{}"),
+        ("max_length", "{}"),
+        ("latency_p50_ms", "{:.1f}"),
+        ("latency_p95_ms", "{:.1f}"),
+        ("accepted_prefix", "{:.2f}"),
+        ("exact_match", "{:.3f}"),
+        ("keystrokes_saved", "{:.2f}"),
+        ("pareto", "{}"),
+    ]
+    cells = [[name for name, _ in columns]] + [
+        [fmt.format(row[name]) for name, fmt in columns]
+        for row in sorted(rows, key=lambda row: row["latency_p95_ms"])
+    ]
+    widths = [max(len(line[i]) for line in cells) for i in range(len(columns))]
+    for line in cells:
+        print("  ".join(cell.ljust(width) for cell, width in zip(line, widths)))
+
+
+def write_csv(rows, path):
+    """
+    Write the table to a .csv, and the per-request latencies to a second .csv
+    next to it with one row per request.
+    """
+    config_columns = ["model", "backend", "num_beams", "max_length"]
+    summary = [
+        {name: value for name, value in row.items() if name != "latencies_ms"}
+        for row in rows
+    ]
+    with open(path, "w", encoding="utf-8", newline="") as file:
+        writer = csv.DictWriter(file, fieldnames=list(summary[0]))
+        writer.writeheader()
+        writer.writerows(summary)
+
+    latencies_path = os.path.splitext(path)[0] + "_latencies.csv"
+    with open(latencies_path, "w", encoding="utf-8", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(config_columns + ["request", "latency_ms"])
+        for row in rows:
+            config = [row[name] for name in config_columns]
+            for i, latency in enumerate(row["latencies_ms"]):
+                writer.writerow(config + [i, latency])
+    print(f"Per-request latencies saved to {latencies_path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("threads_file", help="threads.json with the emails")
+    parser.add_argument(
+        "--models", nargs="+", required=True, help="Model directories or hub names"
+    )
+    parser.add_argument("--backends", nargs="+", default=["generate"], choices=BACKENDS)
+    parser.add_argument("--num-beams", nargs="+", type=int, default=[1, 5])
+    parser.add_argument("--max-lengths", nargs="+", type=int, default=[50])
+    parser.add_argument("--holdout", type=float, default=0.1)
+    parser.add_argument("--max-emails", type=int, default=50)
+    parser.add_argument(
+        "--max-positions", type=int, default=20, help="Suggestions per email"
+    )
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Write the table to this .json or .csv")
+    args = parser.parse_args()
+
+    # Same loading as fine-tuning, then a fixed held-out split of the emails
+    split = load_data(args.threads_file).train_test_split(
+        test_size=args.holdout, seed=args.seed
+    )
+    train_bodies = [body for body in split["train"]["body"] if body]
+    held_out = split["test"].select(range(min(args.max_emails, len(split["test"]))))
+    sessions = [
+        (email["subject"], typing_positions(email["body"] or "", args.max_positions))
+        for email in held_out
+    ]
+    # Emails of fewer than two words have no word to suggest after the first
+    sessions = [(subject, positions) for subject, positions in sessions if positions]
+    if not sessions:
+        parser.error("No held-out email has at least two words")
+    print(
+        f"Evaluating on {len(sessions)} held-out emails "
+        f"({sum(len(positions) for _, positions in sessions)} suggestions "
+        "per configuration)"
+    )
+
+    index = None
+    if "phrase_index" in args.backends:
+        index = PhraseIndex()
+        for body in train_bodies:
+            index.add_text(body)
+
+    rows = []
+    for model_path in args.models:
+        tokenizer, model = ModelLoader(model_path).load()
+        draft = None
+        if "speculative" in args.backends:
+            draft = TokenNgramDraft.from_texts(tokenizer, train_bodies)
+
+        configs = list(
+            itertools.product(args.backends, args.num_beams, args.max_lengths)
+        )
+        for backend, num_beams, max_length in tqdm(configs, desc=model_path):
+            if backend == "speculative" and num_beams != 1:
+                continue  # Speculative decoding is greedy only
+            suggest_fn = make_suggest_fn(
+                backend, tokenizer, model, num_beams, max_length, draft, index
+            )
+            row = {
+                "model": os.path.basename(os.path.normpath(model_path)),
+                "backend": backend,
+                "num_beams": num_beams,
+                "max_length": max_length,
+            }
+            row.update(evaluate(suggest_fn, sessions))
+            rows.append(row)
+
+    mark_pareto(rows)
+    print_table(rows)
+
+    if args.output:
+        if args.output.endswith(".csv"):
+            write_csv(rows, args.output)
+        else:
+            with open(args.output, "w", encoding="utf-8") as file:
+                json.dump(rows, file, indent=4)
+        print(f"Results saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,8 @@
+import argparse
 import os
 import json
+import resource
+import sys
 from transformers import (
     AutoTokenizer,
     AutoModelForSeq2SeqLM,
@@ -20,6 +23,28 @@ OUTPUT_DIR = os.path.join(
 )
 MODEL_NAME = "t5-small"
 
+# Named sets of TrainingArguments. "cpu_low_memory" trades some speed for
+# memory so BART-sized checkpoints fit on CPU-only hosts: batches of one with
+# gradient accumulation (same effective batch of 8), activations recomputed
+# in the backward pass instead of stored, Adafactor's factored second moments
+# instead of AdamW's two full copies of the weights, and bf16 autocast.
+TRAINING_PROFILES = {
+    "default": {
+        "per_device_train_batch_size": 8,
+        "per_device_eval_batch_size": 8,
+        "fp16": torch.cuda.is_available(),
+    },
+    "cpu_low_memory": {
+        "per_device_train_batch_size": 1,
+        "per_device_eval_batch_size": 1,
+        "gradient_accumulation_steps": 8,
+        "gradient_checkpointing": True,
+        "optim": "adafactor",
+        "bf16": True,
+        "use_cpu": True,
+    },
+}
+
 
 def load_data(data_path):
     """Load the dataset from JSON."""
@@ -52,16 +77,60 @@ def tokenize_data(examples, tokenizer, max_input_length=512, max_output_length=1
     return model_inputs
 
 
+def reset_peak_rss():
+    """
+    Reset the process's peak RSS, so it covers training only.
+
+    Returns:
+    - False where this is not possible (anywhere but Linux), in which case the
+      peak includes model loading.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        return False
+    return True
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process in MB."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # ru_maxrss is in bytes on macOS and in KiB elsewhere
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return max_rss / 1024 / 1024
+    return max_rss / 1024
+
+
 def main():
+    parser = argparse.ArgumentParser(description="Fine-tune a seq2seq model.")
+    parser.add_argument("--profile", default="default", choices=TRAINING_PROFILES)
+    parser.add_argument("--model", default=MODEL_NAME)
+    parser.add_argument("--data", default=DATA_PATH)
+    parser.add_argument("--output-dir", default=OUTPUT_DIR)
+    parser.add_argument(
+        "--max-steps", type=int, default=-1, help="Stop early (for benchmarks)"
+    )
+    parser.add_argument("--report", help="Write peak memory and throughput as JSON")
+    args = parser.parse_args()
+    output_dir = args.output_dir
+
     # Load dataset
-    print(f"Loading dataset from {DATA_PATH}...")
-    dataset = load_data(DATA_PATH)
+    print(f"Loading dataset from {args.data}...")
+    dataset = load_data(args.data)
     print(f"Loaded {len(dataset)} examples.")
 
     # Load tokenizer and model
-    print(f"Loading model and tokenizer ({MODEL_NAME})...")
-    tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
-    model = AutoModelForSeq2SeqLM.from_pretrained(MODEL_NAME)
+    print(f"Loading model and tokenizer ({args.model})...")
+    tokenizer = AutoTokenizer.from_pretrained(args.model)
+    model = AutoModelForSeq2SeqLM.from_pretrained(args.model)
 
     # Tokenize dataset
     print("Tokenizing dataset...")
@@ -75,22 +144,21 @@ def main():
     data_collator = DataCollatorForSeq2Seq(tokenizer, model=model)
 
     # Training arguments
-    print("Setting up training arguments...")
+    print(f"Setting up training arguments ({args.profile} profile)...")
     training_args = TrainingArguments(
-        output_dir=OUTPUT_DIR,
+        output_dir=output_dir,
         evaluation_strategy="epoch",
         learning_rate=5e-5,
-        per_device_train_batch_size=8,
-        per_device_eval_batch_size=8,
         num_train_epochs=3,
+        max_steps=args.max_steps,
         weight_decay=0.01,
         save_total_limit=2,
-        logging_dir=os.path.join(OUTPUT_DIR, "logs"),
+        logging_dir=os.path.join(output_dir, "logs"),
         logging_steps=50,
         save_steps=500,
         save_strategy="steps",
-        fp16=True if torch.cuda.is_available() else False,
         push_to_hub=False,
+        **TRAINING_PROFILES[args.profile],
     )
 
     # Trainer
@@ -105,12 +173,27 @@ def main():
 
     # Train
     print("Starting fine-tuning...")
-    trainer.train()
+    peak_reset = reset_peak_rss()
+    train_output = trainer.train()
+    report = {
+        "profile": args.profile,
+        "model": args.model,
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "train_samples_per_second": train_output.metrics["train_samples_per_second"],
+        "train_runtime": train_output.metrics["train_runtime"],
+        "train_loss": train_output.training_loss,
+    }
+    if not peak_reset:
+        report["note"] = "Peak RSS includes model loading (could not reset it)"
+    print(f"Training report: {json.dumps(report)}")
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=4)
 
     # Save the fine-tuned model
-    print(f"Saving model to {OUTPUT_DIR}...")
-    trainer.save_model(OUTPUT_DIR)
-    tokenizer.save_pretrained(OUTPUT_DIR)
+    print(f"Saving model to {output_dir}...")
+    trainer.save_model(output_dir)
+    tokenizer.save_pretrained(output_dir)
     print("Model saved.")
 
 
@@ -0,0 +1,135 @@
+"""
+Output equivalence of speculative_generate and greedy `generate`.
+
+Uses a tiny randomly initialised T5 model, so it runs without the fine-tuned
+checkpoint or any sent mail. Drafts that are always right, partly right and
+always wrong exercise full acceptance, cache cropping and the fallback to
+the model's own token.
+"""
+
+import os
+import sys
+
+import pytest
+
+torch = pytest.importorskip("torch")
+transformers = pytest.importorskip("transformers")
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.abspath(os.path.join(SCRIPT_DIR, ".."))
+sys.path.append(os.path.join(PROJECT_ROOT, "src/common"))
+from speculative_decoding import TokenNgramDraft, speculative_generate
+
+VOCAB_SIZE = 64
+INPUT_IDS = [[5, 9, 12, 7, 3, 30, 41, 1]]
+
+
+def tiny_t5(eos_token_id):
+    torch.manual_seed(0)
+    config = transformers.T5Config(
+        vocab_size=VOCAB_SIZE,
+        d_model=32,
+        d_ff=64,
+        d_kv=8,
+        num_layers=2,
+        num_decoder_layers=2,
+        num_heads=4,
+        decoder_start_token_id=0,
+        pad_token_id=0,
+        eos_token_id=eos_token_id,
+    )
+    return transformers.T5ForConditionalGeneration(config).eval()
+
+
+@pytest.fixture(scope="module")
+def model():
+    return tiny_t5(eos_token_id=1)
+
+
+@pytest.fixture(scope="module")
+def model_without_eos():
+    # Never stops early, so outputs always run to max_length
+    return tiny_t5(eos_token_id=None)
+
+
+def greedy(model, input_ids, max_length):
+    with torch.no_grad():
+        return model.generate(
+            input_ids, max_length=max_length, num_beams=1, do_sample=False
+        )
+
+
+class OracleDraft:
+    """Proposes the reference output, optionally corrupting some tokens."""
+
+    def __init__(self, prompt_length, reference, wrong=lambda i: False):
+        self.prompt_length = prompt_length
+        self.reference = reference
+        self.wrong = wrong
+
+    def propose(self, context, num_tokens):
+        position = 1 + len(context) - self.prompt_length  # After the start token
+        proposal = self.reference[position : position + num_tokens]
+        return [
+            (token + 1) % VOCAB_SIZE if self.wrong(i) else token
+            for i, token in enumerate(proposal)
+        ]
+
+
+DRAFTS = {
+    "right": lambda i: False,
+    "partly_right": lambda i: i % 2 == 1,
+    "wrong": lambda i: True,
+}
+
+
+@pytest.mark.parametrize("draft_kind", DRAFTS)
+@pytest.mark.parametrize("num_draft_tokens", [1, 4, 8])
+@pytest.mark.parametrize("max_length", [2, 3, 7, 20])
+def test_matches_greedy(
+    model, model_without_eos, draft_kind, num_draft_tokens, max_length
+):
+    input_ids = torch.tensor(INPUT_IDS)
+    for m in (model, model_without_eos):
+        expected = greedy(m, input_ids, max_length)
+        prompt_length = len(
+            [token for token in INPUT_IDS[0] if token != m.config.eos_token_id]
+        )
+        draft = OracleDraft(prompt_length, expected[0].tolist(), DRAFTS[draft_kind])
+        output_ids, stats = speculative_generate(
+            m, input_ids, draft, max_length, num_draft_tokens
+        )
+        assert output_ids.tolist() == expected.tolist()
+        assert output_ids.shape[1] <= max_length
+
+        if draft_kind == "right":
+            assert stats["accepted_tokens"] == stats["drafted_tokens"]
+        elif draft_kind == "wrong":
+            assert stats["accepted_tokens"] == 0
+
+
+def test_runs_to_max_length_without_eos(model_without_eos):
+    input_ids = torch.tensor(INPUT_IDS)
+    expected = greedy(model_without_eos, input_ids, 20)
+    draft = OracleDraft(len(INPUT_IDS[0]), expected[0].tolist())
+    output_ids, stats = speculative_generate(model_without_eos, input_ids, draft, 20)
+    assert output_ids.shape[1] == 20
+    # A right draft needs far fewer passes than one per token
+    assert stats["forward_passes"] < 19
+
+
+def test_ngram_draft_matches_greedy(model):
+    input_ids = torch.tensor(INPUT_IDS)
+    expected = greedy(model, input_ids, 20)
+    draft = TokenNgramDraft(order=2)
+    draft.add_token_ids(INPUT_IDS[0][:-1] + expected[0, 1:].tolist())
+    output_ids, _ = speculative_generate(model, input_ids, draft, 20)
+    assert output_ids.tolist() == expected.tolist()
+
+
+def test_empty_draft_matches_greedy(model):
+    input_ids = torch.tensor(INPUT_IDS)
+    expected = greedy(model, input_ids, 20)
+    output_ids, stats = speculative_generate(model, input_ids, TokenNgramDraft(), 20)
+    assert output_ids.tolist() == expected.tolist()
+    assert stats["drafted_tokens"] == 0